@@ -1,3 +1,4 @@
+import asyncio
 from typing import Tuple, Optional, List
 
 from nonebot import logger, get_driver, get_plugin_config, require
@@ -16,22 +17,32 @@ from nonebot_plugin_alconna import (
 )
 from nonebot.adapters.onebot.v11 import Bot, Message, MessageSegment
 from nonebot.params import Depends
+from nonebot.permission import SUPERUSER
 from nonebot.matcher import Matcher
 from nonebot.adapters.onebot.v11.event import GroupMessageEvent
 from nonebot.plugin import PluginMetadata
 from .config import Config
 from .utils import (
     get_reply_id, add_template, remove_template, list_templates, get_prompt,
-    get_images_from_event, forward_images,
-    format_template_list, format_template_content, templates_to_image, find_template
+    get_images_from_event, forward_images, template_registry,
+    format_template_list, format_template_content, templates_to_image, find_template,
+    template_page_count, template_page_items, prerender_template_gallery, suggest_templates
 )
-from .api_handler import generate_template_images
+from .api_handler import generate_template_images, get_key_pool
+from .http_client import init_clients, close_clients
+from .workers import run_in_worker, shutdown_executor
+from .scheduler import generation_scheduler, QueueFullError
+from .result_cache import request_key, shared_generation
+from .delivery import image_segment, setup_output_route
+from .pdf_builder import register_pdf_font, prune_pdf_cache
+from .metrics import format_summary, setup_metrics_route
+from .tracing import current_span, start_span, stage, traced, format_slow_traces
 
 
 usage = """========命令列表========
 - 画图 <模板标识> [图片]/@xxx
 - 添加/删除模板 <模板标识> <提示词>
-- 查看模板 或者 查看模板 <模板标识>"""
+- 查看模板 [页码] 或者 查看模板 <模板标识>"""
 
 # 插件元数据
 __plugin_meta__ = PluginMetadata(
@@ -45,12 +56,28 @@ __plugin_meta__ = PluginMetadata(
 )
 
 plugin_config = get_plugin_config(Config).templates_draw
+setup_output_route()
+setup_metrics_route()
 
 # 插件启动日志
 @get_driver().on_startup
 async def _on_startup():
     keys = plugin_config.gemini_api_keys
     logger.info(f"[templates-draw] Loaded {len(keys)} Keys, max_attempts={plugin_config.max_total_attempts}")
+    upstream = plugin_config.doubao_api_url if plugin_config.api_type == 'doubao' else plugin_config.gemini_api_url
+    init_clients([upstream])
+    await template_registry.recover()
+    template_registry.start_watching()
+    prerender_template_gallery()
+    if plugin_config.gemini_pdf_jailbreak:
+        await run_in_worker(register_pdf_font)
+    await run_in_worker(prune_pdf_cache)
+
+@get_driver().on_shutdown
+async def _on_shutdown():
+    await template_registry.close()
+    await close_clients()
+    shutdown_executor()
 
 # 添加模板
 cmd_add = on_alconna(
@@ -72,7 +99,7 @@ async def _(matcher: Matcher, ident: str, prompt: tuple[str, ...]):
     if not prompt_text.strip():
         await matcher.finish("格式：添加模板 <模板标识> <提示词>")
 
-    add_template(ident, prompt_text)
+    await add_template(ident, prompt_text)
     await matcher.finish(f'✅ 已添加/更新 模板 "{ident}"')
 
 # 删除模板
@@ -91,7 +118,7 @@ async def _(matcher: Matcher, ident: Match[str]):
     if not ident.available:
         await matcher.finish("格式：删除模板 <模板标识>")
 
-    ok = remove_template(ident.result)
+    ok = await remove_template(ident.result)
     if ok:
         await matcher.finish(f'✅ 已删除 模板 "{ident.result}"')
     else:
@@ -129,16 +156,26 @@ async def _(matcher: Matcher, name: Optional[str]):
     if not tpl:
         await matcher.finish("当前没有任何模板")
 
-    # 如果 name 为空，生成模板列表图片
+    # 纯数字且不是模板名时视为页码
+    page = None
     if name is None:
-        formatted_text = format_template_list(tpl)
+        page = 1
+    elif name.isdigit() and name not in tpl:
+        page = int(name)
+
+    # 生成模板列表图片
+    if page is not None:
+        pages = template_page_count(tpl)
+        if not 1 <= page <= pages:
+            await matcher.finish(f"❌ 页码超出范围（共 {pages} 页）")
+        formatted_text = format_template_list(template_page_items(tpl, page))
 
         # 先尝试生成图片
         img_bytes = None
         try:
-            img_bytes = await templates_to_image(tpl)
+            img_bytes = await templates_to_image(tpl, page)
         except Exception:
-            pass
+            logger.exception("模板列表图片生成失败，改为发送文本")
 
         # 图片生成失败发送文本
         if img_bytes:
@@ -158,6 +195,62 @@ async def _(matcher: Matcher, name: Optional[str]):
         # 正常情况，发送模板内容
         await matcher.finish(formatted_text)
 
+# 查看 Key 状态（仅超级用户）
+cmd_key_stats = on_alconna(
+    Alconna("绘图状态"),
+    aliases={"key状态"},
+    permission=SUPERUSER,
+    priority=5,
+    block=True,
+)
+
+@cmd_key_stats.handle()
+async def _(matcher: Matcher):
+    try:
+        stats = get_key_pool().stats()
+    except RuntimeError as e:
+        await matcher.finish(str(e))
+
+    status_map = {"healthy": "✅ 正常", "cooldown": "⏳ 冷却", "quarantined": "⛔ 隔离"}
+    lines = [f"🔑 Key 状态（共 {len(stats)} 个）"]
+    for i, item in enumerate(stats, 1):
+        line = (
+            f"{i}. {item['key']} {status_map[item['status']]}"
+            f" | 进行中 {item['in_flight']} | 成功 {item['success']} / 失败 {item['failure']}"
+        )
+        if item["status"] != "healthy":
+            line += f" | {item['available_in']:.0f}s 后恢复"
+        if item["last_error"]:
+            line += f"\n   最近错误: {item['last_error'][:50]}"
+        lines.append(line)
+    await matcher.finish("\n".join(lines))
+
+# 查看运行指标（仅超级用户）
+cmd_metrics = on_alconna(
+    Alconna("绘图指标"),
+    aliases={"draw_metrics"},
+    permission=SUPERUSER,
+    priority=5,
+    block=True,
+)
+
+@cmd_metrics.handle()
+async def _(matcher: Matcher):
+    await matcher.finish(format_summary())
+
+# 查看最近的慢请求（仅超级用户）
+cmd_traces = on_alconna(
+    Alconna("绘图追踪", Args["count", int, 5]),
+    aliases={"draw_traces"},
+    permission=SUPERUSER,
+    priority=5,
+    block=True,
+)
+
+@cmd_traces.handle()
+async def _(matcher: Matcher, count: int):
+    await matcher.finish(format_slow_traces(count))
+
 # 画图命令
 cmd_draw = on_alconna(
     Alconna(
@@ -179,6 +272,7 @@ cmd_draw.shortcut(
 )
 
 @cmd_draw.handle()
+@traced("draw")
 async def _(
     matcher: Matcher,
     bot: Bot,
@@ -196,6 +290,7 @@ async def _(
     identifier = raw.split()[0] if raw else ""
     if not identifier:
         await matcher.finish(f"💡 模板名称不能为空\n{usage}")
+    current_span().set(template=identifier, group_id=event.group_id, user_id=event.user_id)
 
     # 2. 从 target 抽出所有被 at 用户的 uid
     at_uids: List[str] = []
@@ -223,30 +318,67 @@ async def _(
     # 5. 获取提示词并生成
     prompt = get_prompt(identifier)
     if not prompt:
+        suggestions = suggest_templates(identifier)
+        if suggestions:
+            await matcher.finish(f"❌ 未找到模板 '{identifier}'\n💡 你是不是想找：{'、'.join(suggestions)}")
         await matcher.finish(f"❌ 未找到模板 '{identifier}'\n{usage}")
 
-    await matcher.send("⏳ 正在生成图片，请稍候…")
+    async def _notify_queued(position: int):
+        await matcher.send(f"⏳ 排队中，第 {position} 位，请稍候…")
+
+    # 生成成功时已经单独发出的文本
+    sent_texts: List[str] = []
+
+    async def _send_text(text: str):
+        await matcher.send(text)
+        sent_texts.append(text)
+
+    async def _generate():
+        # 排队等待跨越 async with，手动结束 span
+        waiting = start_span("queue")
+        try:
+            async with generation_scheduler.slot(event.group_id, event.user_id, on_queued=_notify_queued):
+                waiting.end()
+                await matcher.send("⏳ 正在生成图片，请稍候…")
+                return await generate_template_images(final_images, prompt, on_text=_send_text)
+        finally:
+            waiting.end()
+
+    async def _notify_joined():
+        await matcher.send("⏳ 相同的请求正在生成，完成后一并发送…")
+
     try:
-        results = await generate_template_images(final_images, prompt)
+        if plugin_config.request_dedup_enabled or plugin_config.result_cache_ttl > 0:
+            key = await request_key(identifier, prompt, final_images)
+            results = await shared_generation(key, _generate, on_join=_notify_joined)
+        else:
+            results = await _generate()
+    except QueueFullError as e:
+        await matcher.finish(f"❎ {e}")
     except Exception as e:
         await matcher.finish(f"❎ 生成失败：{e}")
 
+    if sent_texts:
+        # 结果与合并的相同请求、结果缓存共用，文本保留给它们，这里只跳过已发过的
+        results = [(img_bytes, img_url, None if text in sent_texts else text) for img_bytes, img_url, text in results]
+
     # 根据配置决定发送方式
     if plugin_config.send_forward_msg:
-        await forward_images(bot, event, results)
+        with stage("send", images=len(results)):
+            await forward_images(bot, event, results)
     else:
         # 逐张发送图片
         for i, (img_bytes, img_url, text) in enumerate(results):
             msg = Message()
             if text:
                 msg.append(str(text))
-            if img_bytes:
-                msg.append(MessageSegment.image(file=img_bytes))
-            elif img_url:
-                msg.append(MessageSegment.image(url=img_url))
+            image_seg = await image_segment(img_bytes, img_url)
+            if image_seg:
+                msg.append(image_seg)
             
             try:
-                await matcher.send(msg)
+                with stage("send", images=1):
+                    await matcher.send(msg)
                 if i < len(results) - 1:
                     await asyncio.sleep(1) 
             except Exception as e:
@@ -1,22 +1,53 @@
-import re, httpx, asyncio, base64, json
-from typing import Dict, Any, List, Optional, Tuple, Union
+import re, time, httpx, asyncio, base64, binascii, json, weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple, Union, NamedTuple, AsyncIterator, Callable, Awaitable
 import httpx
 from PIL import Image
-from io import BytesIO
 from nonebot import logger, get_plugin_config
 
 from .config import Config
-from .utils import (
-    download_image_from_url,
-    build_pdf_from_prompt_and_images
-)
+from .http_client import get_client
+from .key_pool import ApiKeyPool, mask_key, parse_retry_after
+from .preprocess import prepare_image
+from .workers import run_in_worker
+from .pdf_builder import build_pdf_async
+from .utils import download_image_from_url
+from .metrics import ATTEMPTS, ERRORS, KEY_REQUESTS, BYTES_SENT, BYTES_RECEIVED
+from .tracing import current_span, stage, traced
 
 plugin_config = get_plugin_config(Config).templates_draw
 
-# 全局轮询 idx
-_current_api_key_idx = 0
-
-_BASE64_PATTERN = re.compile(r'data:image/[^;,\s]+;base64,([A-Za-z0-9+/=\s]+)')
+# 流式模式下收到文本时的回调
+TextCallback = Callable[[str], Awaitable[Any]]
+
+# 全局 Key 调度池，首次使用时创建
+_key_pool: Optional[ApiKeyPool] = None
+
+# 已编码图片缓存：id(image) -> {最长边上限: (mime_type, base64, 实际最长边)}，图片对象被回收时自动清理
+_encoded_images: Dict[int, Dict[int, Tuple[str, str, int]]] = {}
+# 进行中的编码：(id(image), 最长边上限) -> 任务，并发的尝试 / 对冲请求共用同一次编码
+_encoding: Dict[Tuple[int, int], "asyncio.Task[Tuple[str, str, int]]"] = {}
+
+# 超出总字节预算时，单张图片最长边最多缩小到这个值
+_MIN_BUDGET_EDGE = 256
+
+# 最近上游返回 200 响应的耗时（秒，不含编码和结果下载），用于计算对冲延迟
+_latencies: "deque[float]" = deque(maxlen=200)
+# 样本不足时使用 hedge_initial_delay
+_HEDGE_MIN_SAMPLES = 20
+# 最近一分钟内发起对冲请求的时间
+_hedge_history: "deque[float]" = deque()
+
+# 单遍扫描 data URI 使用的字节模式：只在 data:image/ 出现的位置做锚定匹配
+_DATA_URI_MARKER = b'data:image/'
+_DATA_URI_HEAD = re.compile(rb'data:image/[^;,\s]+;base64,')
+_BASE64_RUN = re.compile(rb'[A-Za-z0-9+/=\s]+')
+# 流式增量拆分使用的文本版本
+_DATA_URI_MARKER_TEXT = _DATA_URI_MARKER.decode()
+_DATA_URI_HEAD_TEXT = re.compile(r'data:image/[^;,\s]+;base64,')
+_BASE64_RUN_TEXT = re.compile(r'[A-Za-z0-9+/=\s]*')
+_MARKDOWN_IMAGE_OPEN = re.compile(r'!\[[^\]\n]*\]\(\s*$')
 _URL_PATTERN = re.compile(r'https?://[^\s\)\]"\'<>]+')
 _IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.svg'}
 _MARKDOWN_CLEANUP = [
@@ -31,6 +62,166 @@ _WHITESPACE_PATTERN = re.compile(r'\n\s*\n')
 _LINE_SPACES_PATTERN = re.compile(r'^\s+|\s+$', re.MULTILINE)
 
 
+def _split_data_uris(text: str) -> Tuple[List[bytes], str]:
+    """
+    单遍扫描文本中的 base64 data URI，返回 (解码后的图片列表, 去掉图片后的剩余文本)。
+    按下标定位 URI，直接对 memoryview 切片解码（a2b_base64 会忽略其中的空白），
+    避免对数 MB 的 base64 串做正则替换和额外拷贝。
+    """
+    raw = text.encode("utf-8")
+    if _DATA_URI_MARKER not in raw:
+        return [], text
+
+    view = memoryview(raw)
+    images: List[bytes] = []
+    pieces: List[bytes] = []
+    pos = 0
+    search_from = 0
+    while True:
+        start = raw.find(_DATA_URI_MARKER, search_from)
+        if start < 0:
+            break
+        head = _DATA_URI_HEAD.match(raw, start)
+        run = _BASE64_RUN.match(raw, head.end()) if head else None
+        if run is None:
+            search_from = start + len(_DATA_URI_MARKER)
+            continue
+        try:
+            img_bytes = binascii.a2b_base64(view[run.start():run.end()])
+        except (binascii.Error, ValueError) as e:
+            logger.warning(f"Base64 提取失败: {e}")
+        else:
+            images.append(img_bytes)
+            pieces.append(raw[pos:start])
+            pos = run.end()
+            logger.debug(f"提取清理 Base64 图片: {len(img_bytes)} bytes")
+        search_from = run.end()
+    pieces.append(raw[pos:])
+    return images, b"".join(pieces).decode("utf-8")
+
+
+class _DataUriStream:
+    """
+    OpenAI 流式 content 的增量拆分：base64 在每个分片到达时按 4 字符一组解码，
+    只保留不足一组的尾巴和可能是 data URI 开头的少量字符，完整响应不会整体驻留内存。
+    feed / close 按原顺序返回已确定的文本段（str）和解码完成的图片（bytes）。
+    """
+
+    # data:image/xxx;base64, 前缀的最大长度，超过仍未匹配则视为普通文本
+    _HEAD_MAX = 64
+
+    def __init__(self):
+        self._buf = ""
+        self._text: List[str] = []
+        self._image: Optional[bytearray] = None
+        self._broken = False
+        self._pending = ""
+        self._after_markdown = False
+
+    def _flush_text(self, items: List[Union[str, bytes]]) -> None:
+        text = "".join(self._text)
+        self._text = []
+        if text:
+            items.append(text)
+
+    def _finish_image(self, items: List[Union[str, bytes]]) -> None:
+        image, self._image = self._image, None
+        pending, self._pending = self._pending, ""
+        if self._broken:
+            self._broken = False
+            return
+        try:
+            if pending:
+                image += binascii.a2b_base64(pending)
+        except (binascii.Error, ValueError) as e:
+            logger.warning(f"Base64 提取失败: {e}")
+            return
+        if image:
+            logger.debug(f"提取清理 Base64 图片: {len(image)} bytes")
+            items.append(bytes(image))
+
+    def _consume_base64(self, items: List[Union[str, bytes]]) -> bool:
+        """解码 base64 直到遇到非 base64 字符，返回该图片是否已结束"""
+        run = _BASE64_RUN_TEXT.match(self._buf)
+        end = run.end() if run else 0
+        chars = self._pending + "".join(self._buf[:end].split())
+        self._buf = self._buf[end:]
+        full = len(chars) // 4 * 4
+        if full and not self._broken:
+            try:
+                self._image += binascii.a2b_base64(chars[:full])
+            except (binascii.Error, ValueError) as e:
+                logger.warning(f"Base64 提取失败: {e}")
+                self._broken = True
+        self._pending = chars[full:]
+        if not self._buf:
+            return False
+        self._finish_image(items)
+        return True
+
+    def feed(self, chunk: str) -> List[Union[str, bytes]]:
+        items: List[Union[str, bytes]] = []
+        self._buf += chunk
+        while self._buf:
+            if self._image is not None:
+                if not self._consume_base64(items):
+                    break
+                continue
+
+            if self._after_markdown:
+                # 去掉 ![image](data:...) 的右括号
+                self._after_markdown = False
+                if self._buf.startswith(")"):
+                    self._buf = self._buf[1:]
+                    continue
+
+            start = self._buf.find(_DATA_URI_MARKER_TEXT)
+            if start < 0:
+                # 末尾可能是被截断的 data:image/ 前缀，留到下一个分片
+                keep = next(
+                    (n for n in range(min(len(_DATA_URI_MARKER_TEXT) - 1, len(self._buf)), 0, -1)
+                     if _DATA_URI_MARKER_TEXT.startswith(self._buf[-n:])),
+                    0,
+                )
+                self._text.append(self._buf[:len(self._buf) - keep])
+                self._buf = self._buf[len(self._buf) - keep:]
+                break
+
+            head = _DATA_URI_HEAD_TEXT.match(self._buf, start)
+            if head is None:
+                rest = self._buf[start:]
+                if len(rest) < self._HEAD_MAX and not re.search(r'[,\s]', rest):
+                    # 前缀还没收完
+                    self._text.append(self._buf[:start])
+                    self._buf = rest
+                    break
+                self._text.append(self._buf[:start + len(_DATA_URI_MARKER_TEXT)])
+                self._buf = self._buf[start + len(_DATA_URI_MARKER_TEXT):]
+                continue
+
+            # 前缀可能跨分片，markdown 开头要在完整的待发文本上查找
+            before = "".join(self._text) + self._buf[:start]
+            opener = _MARKDOWN_IMAGE_OPEN.search(before)
+            if opener:
+                before = before[:opener.start()]
+                self._after_markdown = True
+            self._text = [before]
+            self._flush_text(items)
+            self._image = bytearray()
+            self._buf = self._buf[head.end():]
+        return items
+
+    def close(self) -> List[Union[str, bytes]]:
+        items: List[Union[str, bytes]] = []
+        if self._image is not None:
+            self._finish_image(items)
+        else:
+            self._text.append(self._buf)
+        self._buf = ""
+        self._flush_text(items)
+        return items
+
+
 def extract_images_and_text(
     content: Optional[Union[str, List]],
     parts: Optional[List[Dict]] = None,
@@ -40,17 +231,6 @@ def extract_images_and_text(
     images = []
     text_content = ""
 
-    def _handle_base64_match(match):
-        try:
-            b64str = re.sub(r'\s+', '', match.group(1))
-            img_bytes = base64.b64decode(b64str)
-            images.append((img_bytes, None))
-            logger.debug(f"提取清理 Base64 图片: {len(img_bytes)} bytes")
-            return ""
-        except Exception as e:
-            logger.warning(f"Base64 提取失败: {e}")
-            return match.group(0)
-
     def _handle_url_match(match):
         url = match.group(0)
         if any(url.lower().endswith(ext) for ext in _IMAGE_EXTS):
@@ -95,21 +275,17 @@ def extract_images_and_text(
             elif part.get("type") == "image_url":
                 url = part.get("image_url", {}).get("url", "")
                 if url.startswith("data:image/"):
-                    match = _BASE64_PATTERN.match(url)
-                    if match:
-                        try:
-                            b64str = re.sub(r'\s+', '', match.group(1))
-                            images.append((base64.b64decode(b64str), None))
-                        except Exception:
-                            pass
+                    decoded, _ = _split_data_uris(url)
+                    images.extend((img_bytes, None) for img_bytes in decoded)
                 elif url:
                     images.append((None, url))
 
         text_content = text_content.strip()
 
     elif isinstance(content, str):
-        text_content = content
-        text_content = _BASE64_PATTERN.sub(_handle_base64_match, text_content)
+        decoded, text_content = _split_data_uris(content)
+        images.extend((img_bytes, None) for img_bytes in decoded)
+        # 以下清理只作用于去掉 base64 后的剩余文本
         text_content = _URL_PATTERN.sub(_handle_url_match, text_content)
 
         for pattern in _MARKDOWN_CLEANUP:
@@ -123,27 +299,50 @@ def extract_images_and_text(
 
 async def process_images_from_content(
     image_list: List[Tuple[Optional[bytes], Optional[str]]],
-    text_content: Optional[str],
-    client: httpx.AsyncClient
+    text_content: Optional[str]
 ) -> List[Tuple[Optional[bytes], Optional[str], Optional[str]]]:
-    """处理从内容中提取的图片"""
-    results = []
+    """
+    处理从内容中提取的图片：URL 图片按 result_download_concurrency 并发下载，
+    结果保持原顺序，文本附在第一张图片上，下载失败的保留 URL
+    """
+    semaphore = asyncio.Semaphore(max(1, plugin_config.result_download_concurrency))
+
+    async def _download(url: str) -> Optional[bytes]:
+        async with semaphore:
+            with stage("result_download") as current:
+                data = await download_image_from_url(
+                    url,
+                    timeout=plugin_config.result_download_timeout,
+                    retries=plugin_config.result_download_retries,
+                    max_bytes=int(plugin_config.result_max_mb * 1024 * 1024),
+                )
+                if data:
+                    current.set(response_bytes=len(data))
+            if data:
+                BYTES_RECEIVED.inc(len(data), source="result")
+            return data
+
+    async def _resolve(img_bytes: Optional[bytes], img_url: Optional[str]) -> Optional[bytes]:
+        if img_bytes or not img_url:
+            return img_bytes
+        return await _download(img_url)
+
+    resolved = await asyncio.gather(*(_resolve(b, u) for b, u in image_list))
 
-    for idx, (img_bytes, img_url) in enumerate(image_list):
+    results = []
+    for idx, ((img_bytes, img_url), data) in enumerate(zip(image_list, resolved)):
+        if not img_bytes and not img_url:
+            continue
+        text = text_content if not results else None
         if img_bytes:
-            text = text_content if idx == 0 else None
             results.append((img_bytes, None, text))
             logger.info(f"成功解码第 {idx + 1} 张图片（Base64），大小: {len(img_bytes)} bytes")
-        elif img_url:
-            downloaded = await download_image_from_url(img_url, client)
-            if downloaded:
-                text = text_content if idx == 0 and not results else None
-                results.append((downloaded, img_url, text))
-                logger.info(f"成功下载第 {idx + 1} 张图片（URL），大小: {len(downloaded)} bytes")
-            else:
-                text = text_content if idx == 0 and not results else None
-                results.append((None, img_url, text))
-                logger.warning(f"第 {idx + 1} 张图片下载失败，保留 URL: {img_url}")
+        elif data:
+            results.append((data, img_url, text))
+            logger.info(f"成功下载第 {idx + 1} 张图片（URL），大小: {len(data)} bytes")
+        else:
+            results.append((None, img_url, text))
+            logger.warning(f"第 {idx + 1} 张图片下载失败，保留 URL: {img_url}")
 
     return results
 
@@ -164,14 +363,100 @@ def get_valid_api_keys() -> list:
         raise RuntimeError("请先在 env 中配置有效的 API Key (gemini_api_keys)")
     return keys
 
-def encode_image_to_base64(image: Image.Image) -> str:
-    """将 PIL Image 编码为 base64 字符串"""
-    buf = BytesIO()
-    image.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode()
+def get_key_pool() -> ApiKeyPool:
+    """获取全局 Key 调度池"""
+    global _key_pool
+    if _key_pool is None:
+        _key_pool = ApiKeyPool(
+            get_valid_api_keys(),
+            cooldown_seconds=plugin_config.key_cooldown_seconds,
+            timeout_cooldown_seconds=plugin_config.key_timeout_cooldown_seconds,
+            quarantine_threshold=plugin_config.key_quarantine_threshold,
+            quarantine_seconds=plugin_config.key_quarantine_seconds,
+        )
+    return _key_pool
+
+def _key_pool_samples() -> Dict[Tuple[str, ...], float]:
+    """Key 调度池里已有成功/失败计数，抓取指标时直接读取"""
+    if _key_pool is None:
+        return {}
+    samples: Dict[Tuple[str, ...], float] = {}
+    for item in _key_pool.stats():
+        # 脱敏后的 Key 可能重复，累加而不是覆盖
+        for result in ("success", "failure"):
+            label = (item["key"], result)
+            samples[label] = samples.get(label, 0) + item[result]
+    return samples
+
+KEY_REQUESTS.collect_with(_key_pool_samples)
+
+def _encoded_slot(image: Image.Image) -> Dict[int, Tuple[str, str, int]]:
+    key = id(image)
+    slot = _encoded_images.get(key)
+    if slot is None:
+        slot = _encoded_images[key] = {}
+        weakref.finalize(image, _encoded_images.pop, key, None)
+    return slot
+
+def encode_image_to_base64(image: Image.Image, max_edge: Optional[int] = None) -> Tuple[str, str]:
+    """
+    预处理并编码图片，返回 (mime_type, base64)。
+    同一图片对象在同一尺寸上限下只编码一次。
+    """
+    if max_edge is None:
+        max_edge = plugin_config.input_max_edge
+    slot = _encoded_slot(image)
+    if max_edge not in slot:
+        slot[max_edge] = prepare_image(
+            image, max_edge, plugin_config.input_image_format, plugin_config.input_image_quality
+        )
+    mime, b64data, _ = slot[max_edge]
+    return mime, b64data
+
+async def encode_image_async(image: Image.Image, max_edge: Optional[int] = None) -> Tuple[str, str, int]:
+    """在执行器中预处理并编码图片，返回 (mime_type, base64, 实际最长边)"""
+    if max_edge is None:
+        max_edge = plugin_config.input_max_edge
+    slot = _encoded_slot(image)
+    if max_edge in slot:
+        return slot[max_edge]
+
+    key = (id(image), max_edge)
+    task = _encoding.get(key)
+    if task is None:
+        async def _encode() -> Tuple[str, str, int]:
+            try:
+                slot[max_edge] = await run_in_worker(
+                    prepare_image, image, max_edge, plugin_config.input_image_format, plugin_config.input_image_quality
+                )
+                return slot[max_edge]
+            finally:
+                _encoding.pop(key, None)
+
+        task = _encoding[key] = asyncio.create_task(_encode())
+    # 某个等待者被取消（如对冲请求落败）不影响其他等待者
+    return await asyncio.shield(task)
+
+async def encode_images(images: List[Image.Image]) -> List[Tuple[str, str]]:
+    """
+    并行编码多张图片，返回 [(mime_type, base64)]，之后各次尝试、各个 Key 直接复用结果。
+    总大小超过 input_max_total_mb 时，反复把最大的一张缩小后重新编码。
+    """
+    encoded = list(await asyncio.gather(*(encode_image_async(img) for img in images)))
+
+    budget = int(plugin_config.input_max_total_mb * 1024 * 1024)
+    while budget and sum(len(b64data) for _, b64data, _ in encoded) > budget:
+        idx = max(range(len(encoded)), key=lambda i: len(encoded[i][1]))
+        edge = encoded[idx][2]
+        if edge <= _MIN_BUDGET_EDGE:
+            logger.warning(f"参考图总大小仍超出预算 {plugin_config.input_max_total_mb}MB，按当前尺寸发送")
+            break
+        encoded[idx] = await encode_image_async(images[idx], max(_MIN_BUDGET_EDGE, int(edge * 0.75)))
 
-def build_request_config(api_key: str, model_name: str) -> Tuple[str, Dict[str, str], str]:
-    """构建请求配置（URL、Headers、API类型）"""
+    return [(mime, b64data) for mime, b64data, _ in encoded]
+
+def build_request_config(api_key: str, model_name: str, stream: bool = False) -> Tuple[str, Dict[str, str], str]:
+    """构建请求配置（URL、Headers、API类型），stream 仅影响 Gemini Native 的端点"""
     if is_openai_compatible():
         url = plugin_config.gemini_api_url
         if "chat/completions" not in url:
@@ -197,11 +482,14 @@ def build_request_config(api_key: str, model_name: str) -> Tuple[str, Dict[str,
         if base_url.endswith('/v1beta'):
             base_url = base_url[:-7]
 
-        url = f"{base_url}/v1beta/models/{model_name}:generateContent?key={api_key}"
+        if stream:
+            url = f"{base_url}/v1beta/models/{model_name}:streamGenerateContent?alt=sse&key={api_key}"
+        else:
+            url = f"{base_url}/v1beta/models/{model_name}:generateContent?key={api_key}"
         headers = {"Content-Type": "application/json"}
         return url, headers, "gemini"
 
-def build_payload(
+async def build_payload(
     api_type: str,
     images: List[Image.Image],
     prompt: str,
@@ -253,11 +541,10 @@ def build_payload(
             "extra_content": signature_payload
         }]
 
-        for img in images:
-            b64data = encode_image_to_base64(img)
+        for mime, b64data in await encode_images(images):
             user_content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{b64data}"},
+                "image_url": {"url": f"data:{mime};base64,{b64data}"},
                 "extra_content": signature_payload
             })
 
@@ -297,10 +584,12 @@ def build_payload(
             raise ValueError("Doubao API requires at least one image.")
         
         # Support single or multiple images
-        if len(images) == 1:
-            image_data = f"data:image/png;base64,{encode_image_to_base64(images[0])}"
+        encoded = await encode_images(images)
+        if len(encoded) == 1:
+            mime, b64data = encoded[0]
+            image_data = f"data:{mime};base64,{b64data}"
         else:
-            image_data = [f"data:image/png;base64,{encode_image_to_base64(img)}" for img in images]
+            image_data = [f"data:{mime};base64,{b64data}" for mime, b64data in encoded]
         
         return {
             "model": plugin_config.doubao_model,
@@ -315,7 +604,7 @@ def build_payload(
         if use_pdf:
             # PDF 模式：将 prompt + 图片构建为 PDF
             logger.info("使用 PDF 模式发送（prompt + 参考图）")
-            pdf_bytes = build_pdf_from_prompt_and_images(prompt, images)
+            pdf_bytes = await build_pdf_async(prompt, images)
             pdf_b64 = base64.b64encode(pdf_bytes).decode()
 
             # --- 第1轮：User 发送 PDF ---
@@ -334,11 +623,10 @@ def build_payload(
                 "thought_signature": "skip_thought_signature_validator"
             }]
 
-            for img in images:
-                b64data = encode_image_to_base64(img)
+            for mime, b64data in await encode_images(images):
                 user_parts.append({
                     "inlineData": {
-                        "mimeType": "image/png",
+                        "mimeType": mime,
                         "data": b64data
                     },
                     "thought_signature": "skip_thought_signature_validator"
@@ -521,116 +809,451 @@ def generate_final_error_message(max_attempts: int, last_error: str, api_connect
             f"最后错误：{last_error}"
         )
 
+@traced("generate")
 async def generate_template_images(
     images: List[Image.Image],
-    prompt: Optional[str] = None
+    prompt: Optional[str] = None,
+    on_text: Optional[TextCallback] = None
 ) -> List[Tuple[Optional[bytes], Optional[str], Optional[str]]]:
     """
     对外接口：生成图片
     根据 plugin_config.sequential_image_generation 配置决定是顺序生成还是批量生成
+    on_text: 某次尝试成功时用该次响应的完整文本回调一次（文本仍保留在结果中）
     """
     if not images:
         raise RuntimeError("没有传入任何图片")
 
+    current_span().set(images=len(images), sequential=plugin_config.sequential_image_generation)
+
     if plugin_config.sequential_image_generation:
-        results = []
-        for img in images:
-             # Process one by one
-             # Note: prompt is applied to all
-             res = await _generate_template_images_core([img], prompt)
-             results.extend(res)
-        return results
+        return await _generate_template_images_fanout(images, prompt, on_text)
     else:
-        return await _generate_template_images_core(images, prompt)
+        return await _generate_template_images_core(images, prompt, on_text)
 
-async def _generate_template_images_core(
+async def _generate_template_images_fanout(
     images: List[Image.Image],
-    prompt: Optional[str] = None
+    prompt: Optional[str] = None,
+    on_text: Optional[TextCallback] = None
 ) -> List[Tuple[Optional[bytes], Optional[str], Optional[str]]]:
     """
-    调用 Gemini/OpenAI 接口生成图片
-    根据 plugin_config.gemini_pdf_jailbreak 决定是否使用 PDF 模式（仅 Gemini Native）
+    多图分别生成：按 sequential_max_concurrency 限制并发，
+    每张图各自轮询 Key，结果按输入顺序返回，单张失败以文本形式报告
     """
-    global _current_api_key_idx
+    semaphore = asyncio.Semaphore(max(1, plugin_config.sequential_max_concurrency))
 
-    keys = get_valid_api_keys()
+    async def _run(img: Image.Image):
+        async with semaphore:
+            return await _generate_template_images_core([img], prompt, on_text)
 
-    if not images:
-        raise RuntimeError("没有传入任何图片")
+    outcomes = await asyncio.gather(*(_run(img) for img in images), return_exceptions=True)
 
-    if not prompt:
-        prompt = "请根据参考图生成新图片"
+    results = []
+    errors = []
+    for idx, outcome in enumerate(outcomes, start=1):
+        if isinstance(outcome, BaseException):
+            logger.warning(f"第 {idx} 张图片生成失败: {outcome}")
+            errors.append(f"第 {idx} 张图片生成失败：{outcome}")
+            results.append((None, None, errors[-1]))
+        else:
+            results.extend(outcome)
 
-    last_err = ""
-    api_connection_failed = False
+    if len(errors) == len(images):
+        raise RuntimeError("\n".join(errors))
+    return results
 
-    # 检查是否使用 PDF 模式（仅 Gemini Native 支持）
-    use_pdf = plugin_config.gemini_pdf_jailbreak and not is_openai_compatible()
+def _record_traffic(resp: httpx.Response) -> None:
+    sent = len(resp.request.content)
+    BYTES_SENT.inc(sent)
+    BYTES_RECEIVED.inc(resp.num_bytes_downloaded, source="upstream")
+    current_span().set(status_code=resp.status_code, request_bytes=sent, response_bytes=resp.num_bytes_downloaded)
+
+@asynccontextmanager
+async def _upstream_stream(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any]
+) -> AsyncIterator[httpx.Response]:
+    """流式请求：解析与接收交错进行，整个流的耗时都计入 upstream 阶段，结束时统计收发字节"""
+    with stage("upstream"):
+        async with client.stream("POST", url, headers=headers, json=payload) as resp:
+            try:
+                yield resp
+            finally:
+                _record_traffic(resp)
+
+class UpstreamResult(NamedTuple):
+    """一次上游请求的结果"""
+    status_code: int
+    retry_after: Optional[float] = None
+    error: Optional[str] = None    # HTTP 错误、被屏蔽或解析失败的原因
+    images: List[Tuple[Optional[bytes], Optional[str]]] = []
+    text: Optional[str] = None
+
+async def _request_plain(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    api_type: str,
+    attempt: int
+) -> UpstreamResult:
+    """普通模式：等待完整响应后解析"""
+    with stage("upstream"):
+        resp = await client.post(url, headers=headers, json=payload)
+        _record_traffic(resp)
+    if resp.status_code != 200:
+        return UpstreamResult(
+            resp.status_code,
+            retry_after=parse_retry_after(resp.headers.get("Retry-After")),
+            error=handle_http_error(resp.status_code, resp.text, attempt),
+        )
 
-    for attempt in range(1, plugin_config.max_total_attempts + 1):
-        idx = _current_api_key_idx % len(keys)
-        key = keys[idx]
-        _current_api_key_idx += 1
+    raw_response_text = resp.text
+    logger.debug(f"[Attempt {attempt}] 原始响应内容 (前1000字符): {raw_response_text[:1000]}")
 
+    with stage("parse"):
         try:
-            async with httpx.AsyncClient(timeout=120) as client:
-                current_model_name = plugin_config.doubao_model if plugin_config.api_type == 'doubao' else plugin_config.gemini_model
-                logger.info(f"[Attempt {attempt}] 发送请求 (Model: {current_model_name}, PDF模式: {use_pdf})")
-
-                url, headers, api_type = build_request_config(key, plugin_config.gemini_model)
-                payload = build_payload(api_type, images, prompt, use_pdf)
-
-                try:
-                    resp = await client.post(url, headers=headers, json=payload)
-                except Exception as e:
-                    last_err, is_connection_error = handle_network_error(e, attempt)
-                    if is_connection_error:
-                        api_connection_failed = True
-                    await asyncio.sleep(1)
-                    continue
+            data = resp.json()
+        except Exception as e:
+            return UpstreamResult(200, error=f"JSON 解析失败: {e}")
 
-                if resp.status_code != 200:
-                    last_err = handle_http_error(resp.status_code, resp.text, attempt)
-                    await asyncio.sleep(1)
-                    continue
+        content, parts, error_msg = parse_api_response(data, api_type)
+        if error_msg:
+            return UpstreamResult(200, error=error_msg)
+
+        image_list, text_content = extract_images_and_text(content, parts, api_type)
+    return UpstreamResult(200, images=image_list, text=text_content)
 
-                raw_response_text = resp.text
-                logger.debug(f"[Attempt {attempt}] 原始响应内容 (前1000字符): {raw_response_text[:1000]}")
+async def _iter_sse_events(resp: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """逐个解析 SSE 事件中的 JSON 数据"""
+    data_lines: List[str] = []
+    async for line in resp.aiter_lines():
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+            continue
+        if line or not data_lines:
+            continue
+        data = "\n".join(data_lines)
+        data_lines = []
+        if data == "[DONE]":
+            return
+        yield json.loads(data)
+    if data_lines and data_lines[0] != "[DONE]":
+        yield json.loads("\n".join(data_lines))
+
+async def _emit_text(on_text: Optional[TextCallback], text: Optional[str]) -> None:
+    if not on_text or not text:
+        return
+    try:
+        await on_text(text)
+    except Exception as e:
+        logger.warning(f"文本发送失败: {e}")
+
+async def _request_stream(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    api_type: str,
+    attempt: int
+) -> UpstreamResult:
+    """
+    流式模式：Gemini 使用 streamGenerateContent?alt=sse，OpenAI 使用 stream: true。
+    图片在对应事件到达时立即解码，原始 base64 不会整体驻留内存；
+    OpenAI 的 content 按 data URI 增量切分。文本先缓存，由调用方在尝试成功后统一发送。
+    """
+    image_list: List[Tuple[Optional[bytes], Optional[str]]] = []
+    texts: List[str] = []
+    openai_stream = _DataUriStream()
+
+    def _take(items: List[Union[str, bytes]]) -> None:
+        for item in items:
+            if isinstance(item, bytes):
+                image_list.append((item, None))
+                continue
+            imgs, text = extract_images_and_text(item, None, api_type)
+            image_list.extend(imgs)
+            if text:
+                texts.append(text)
+
+    async with _upstream_stream(client, url, headers, payload) as resp:
+        if resp.status_code != 200:
+            await resp.aread()
+            return UpstreamResult(
+                resp.status_code,
+                retry_after=parse_retry_after(resp.headers.get("Retry-After")),
+                error=handle_http_error(resp.status_code, resp.text, attempt),
+            )
 
-                try:
-                    data = resp.json()
-                except Exception as e:
-                    last_err = f"JSON 解析失败: {e}"
+        try:
+            async for chunk in _iter_sse_events(resp):
+                if chunk.get("error"):
+                    _, _, error_msg = parse_api_response(chunk, api_type)
+                    return UpstreamResult(200, error=error_msg)
+
+                if api_type == "openai":
+                    choices = chunk.get("choices") or [{}]
+                    delta = choices[0].get("delta") or {}
+                    if isinstance(delta.get("content"), str):
+                        _take(openai_stream.feed(delta["content"]))
+                    elif isinstance(delta.get("content"), list):
+                        imgs, text = extract_images_and_text(delta["content"], None, api_type)
+                        image_list.extend(imgs)
+                        if text:
+                            _take(openai_stream.feed(text))
+                    if delta.get("images"):
+                        imgs, _ = extract_images_and_text(delta["images"], None, api_type)
+                        image_list.extend(imgs)
                     continue
 
-                content, parts, error_msg = parse_api_response(data, api_type)
-                if error_msg:
-                    last_err = error_msg
+                # Gemini：屏蔽信息可能出现在任意一个事件里
+                candidate = (chunk.get("candidates") or [{}])[0]
+                if (chunk.get("promptFeedback") or {}).get("blockReason") or \
+                        candidate.get("finishReason") in ("SAFETY", "RECITATION", "PROHIBITED_CONTENT"):
+                    _, _, error_msg = parse_api_response(chunk, api_type)
+                    return UpstreamResult(200, error=error_msg)
+
+                parts = (candidate.get("content") or {}).get("parts") or []
+                if not parts:
                     continue
+                imgs, text = extract_images_and_text(None, parts, api_type)
+                if imgs:
+                    logger.debug(f"[Attempt {attempt}] 流式收到 {len(imgs)} 张图片")
+                    image_list.extend(imgs)
+                if text:
+                    texts.append(text)
+        except json.JSONDecodeError as e:
+            return UpstreamResult(200, error=f"流式响应解析失败: {e}")
+
+    _take(openai_stream.close())
+
+    text_content = "\n".join(texts) or None
+    return UpstreamResult(200, images=image_list, text=text_content)
+
+class AttemptOutcome(NamedTuple):
+    """一次尝试（一个 Key 的一次请求）的最终结果"""
+    results: Optional[List[Tuple[Optional[bytes], Optional[str], Optional[str]]]] = None
+    error: str = ""
+    connection_failed: bool = False
+    backoff: bool = False    # 失败后是否需要等待再重试
+    text: Optional[str] = None    # 成功时上游返回的文本
+
+class _SharedPayload:
+    """
+    一次生成内共用的请求体：第一次尝试时构建（编码参考图或生成 PDF），
+    之后的重试与对冲请求直接复用；构建失败时下一次尝试重新构建
+    """
 
-                image_list, text_content = extract_images_and_text(content, parts, api_type)
+    def __init__(self, images: List[Image.Image], prompt: str, use_pdf: bool):
+        self.images = images
+        self.prompt = prompt
+        self.use_pdf = use_pdf
+        self._task: Optional["asyncio.Task[Dict[str, Any]]"] = None
+
+    async def get(self, api_type: str) -> Dict[str, Any]:
+        task = self._task
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = self._task = asyncio.create_task(build_payload(api_type, self.images, self.prompt, self.use_pdf))
+        # 返回浅拷贝，各请求可以单独加 stream 等字段
+        return dict(await asyncio.shield(task))
+
+    def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+@traced("attempt")
+async def _run_attempt(
+    key_pool: ApiKeyPool,
+    key: str,
+    attempt: int,
+    request: _SharedPayload
+) -> AttemptOutcome:
+    """用指定 Key 发送一次请求并解析结果，结束时归还 Key"""
+    # 本次尝试的结果，用于更新 Key 健康状态
+    status_code: Optional[int] = None
+    retry_after: Optional[float] = None
+    timed_out = False
+    key_error = ""
+    current_span().set(attempt=attempt, key=mask_key(key))
+
+    try:
+        current_model_name = plugin_config.doubao_model if plugin_config.api_type == 'doubao' else plugin_config.gemini_model
+        use_stream = plugin_config.stream_response and plugin_config.api_type != 'doubao'
+        logger.info(f"[Attempt {attempt}] 发送请求 (Model: {current_model_name}, PDF模式: {request.use_pdf}, 流式: {use_stream})")
+
+        url, headers, api_type = build_request_config(key, plugin_config.gemini_model, stream=use_stream)
+        with stage("encode", api_type=api_type, images=len(request.images), pdf=request.use_pdf):
+            payload = await request.get(api_type)
+
+        ATTEMPTS.inc(api_type=api_type)
+
+        client = get_client(url)
+        started = time.monotonic()
+        try:
+            if use_stream:
+                if api_type == "openai":
+                    payload["stream"] = True
+                result = await _request_stream(client, url, headers, payload, api_type, attempt)
+            else:
+                result = await _request_plain(client, url, headers, payload, api_type, attempt)
+        except Exception as e:
+            error, is_connection_error = handle_network_error(e, attempt)
+            timed_out = isinstance(e, httpx.TimeoutException)
+            key_error = error
+            ERRORS.inc(kind=type(e).__name__)
+            return AttemptOutcome(error=error, connection_failed=is_connection_error, backoff=True)
+
+        status_code = result.status_code
+        if result.status_code != 200:
+            retry_after = result.retry_after
+            key_error = result.error
+            ERRORS.inc(kind="http", status=result.status_code)
+            return AttemptOutcome(error=result.error, backoff=True)
+
+        # 只统计上游响应耗时（不含编码和结果下载），没有图片的 200 响应同样计入
+        _record_latency(time.monotonic() - started)
+
+        if result.error:
+            ERRORS.inc(kind="response", status=200)
+            return AttemptOutcome(error=result.error)
+
+        logger.info(f"提取到 {len(result.images)} 张图片")
+        logger.info(f"提取到的文本: {result.text[:100] if result.text else 'None'}")
+
+        if not result.images:
+            ERRORS.inc(kind="no_image", status=200)
+            return AttemptOutcome(error="未找到图片数据")
+
+        results = await process_images_from_content(result.images, result.text)
+        if not results:
+            ERRORS.inc(kind="result_download", status=200)
+            return AttemptOutcome(error="图片解析/下载失败")
+
+
+        logger.info(f"成功解析 {len(results)} 张图片")
+        return AttemptOutcome(results=results, text=result.text)
+
+    except Exception as e:
+        error, is_connection_error = handle_network_error(e, attempt)
+        ERRORS.inc(kind=type(e).__name__)
+        return AttemptOutcome(error=error, connection_failed=is_connection_error, backoff=True)
+
+    finally:
+        current_span().set(status_code=status_code, error=key_error or None)
+        key_pool.release(
+            key,
+            status_code=status_code,
+            retry_after=retry_after,
+            timeout=timed_out,
+            error=key_error,
+        )
 
-                logger.info(f"提取到 {len(image_list)} 张图片")
-                logger.info(f"提取到的文本: {text_content[:100] if text_content else 'None'}")
+def _record_latency(seconds: float) -> None:
+    _latencies.append(seconds)
+
+def _hedge_delay() -> Optional[float]:
+    """发起对冲请求前的等待时间，未开启对冲时返回 None"""
+    if not plugin_config.hedge_enabled:
+        return None
+    if len(_latencies) < _HEDGE_MIN_SAMPLES:
+        return plugin_config.hedge_initial_delay
+    ordered = sorted(_latencies)
+    idx = min(len(ordered) - 1, int(len(ordered) * plugin_config.hedge_percentile / 100))
+    return ordered[idx]
+
+def _take_hedge_budget() -> bool:
+    """每分钟最多发起 hedge_max_per_minute 次对冲请求"""
+    now = time.monotonic()
+    while _hedge_history and now - _hedge_history[0] > 60:
+        _hedge_history.popleft()
+    if len(_hedge_history) >= plugin_config.hedge_max_per_minute:
+        return False
+    _hedge_history.append(now)
+    return True
+
+async def _run_hedged_attempt(
+    key_pool: ApiKeyPool,
+    attempt: int,
+    request: _SharedPayload
+) -> AttemptOutcome:
+    """
+    发起一次尝试；开启对冲时，若超过延迟仍未返回，则用另一个 Key 再发一个请求，
+    先成功者胜出，另一个被取消
+    """
+    primary_key = key_pool.acquire()
+    delay = _hedge_delay()
+    if delay is None or len(key_pool.keys) < 2:
+        return await _run_attempt(key_pool, primary_key, attempt, request)
+
+    tasks = {asyncio.create_task(_run_attempt(key_pool, primary_key, attempt, request))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and not key_pool.has_healthy(exclude=[primary_key]):
+            # 其他 Key 都在冷却/隔离中，对冲只会浪费预算甚至延长限流
+            logger.debug(f"[Attempt {attempt}] 没有其他健康的 Key，不发起对冲请求")
+        elif not done and _take_hedge_budget():
+            hedge_key = key_pool.acquire(exclude=[primary_key])
+            logger.info(f"[Attempt {attempt}] {delay:.1f}s 未返回，使用另一个 Key 发起对冲请求")
+            tasks.add(asyncio.create_task(
+                _run_attempt(key_pool, hedge_key, attempt, request)
+            ))
+
+        outcome = AttemptOutcome()
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                outcome = task.result()
+                if outcome.results:
+                    return outcome
+        return outcome
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-                if not image_list:
-                    last_err = "未找到图片数据"
-                    continue
+async def _generate_template_images_core(
+    images: List[Image.Image],
+    prompt: Optional[str] = None,
+    on_text: Optional[TextCallback] = None
+) -> List[Tuple[Optional[bytes], Optional[str], Optional[str]]]:
+    """
+    调用 Gemini/OpenAI 接口生成图片
+    根据 plugin_config.gemini_pdf_jailbreak 决定是否使用 PDF 模式（仅 Gemini Native）
+    根据 plugin_config.stream_response 决定是否使用流式响应（豆包不支持）
+    根据 plugin_config.hedge_enabled 决定慢请求是否用另一个 Key 对冲
+    """
+    key_pool = get_key_pool()
 
-                results = await process_images_from_content(image_list, text_content, client)
-                if results:
-                    logger.info(f"成功解析 {len(results)} 张图片")
-                    return results
-                else:
-                    last_err = "图片解析/下载失败"
-                    continue
+    if not images:
+        raise RuntimeError("没有传入任何图片")
 
-        except Exception as e:
-            last_err, is_connection_error = handle_network_error(e, attempt)
-            if is_connection_error:
+    if not prompt:
+        prompt = "请根据参考图生成新图片"
+
+    last_err = ""
+    api_connection_failed = False
+
+    # 检查是否使用 PDF 模式（仅 Gemini Native 支持）
+    use_pdf = plugin_config.gemini_pdf_jailbreak and not is_openai_compatible()
+
+    request = _SharedPayload(images, prompt, use_pdf)
+    try:
+        for attempt in range(1, plugin_config.max_total_attempts + 1):
+            outcome = await _run_hedged_attempt(key_pool, attempt, request)
+            if outcome.results:
+                # 只有胜出的尝试发送文本，重试和落败的对冲请求不会重复发送
+                await _emit_text(on_text, outcome.text)
+                return outcome.results
+
+            last_err = outcome.error
+            if outcome.connection_failed:
                 api_connection_failed = True
-            await asyncio.sleep(1)
-            continue
+            if outcome.backoff:
+                await asyncio.sleep(1)
+    finally:
+        request.close()
 
     error_message = generate_final_error_message(
         plugin_config.max_total_attempts,
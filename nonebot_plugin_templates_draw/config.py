@@ -13,12 +13,71 @@ class ScopedConfig(BaseModel):
     gemini_api_keys: List[str] = ['xxxxxx']    # API Key 列表，支持 Gemini/OpenAI/Doubao
     gemini_model: str = 'gemini-2.5-flash-image-preview'    # Gemini 模型 默认为 gemini-2.5-flash-image-preview
     gemini_pdf_jailbreak: bool = False    # 使用发送pdf来破限，默认关闭
+    pdf_cache_enabled: bool = False    # 保存每次构建的 PDF 到缓存目录，便于排查
+    pdf_cache_max_mb: float = 100    # PDF 缓存目录大小上限（MB），超出按修改时间淘汰
+    pdf_cache_max_age: int = 86400    # PDF 缓存保留时间（秒）
     max_total_attempts: int = 2    # 这一张图的最大尝试次数（包括首次尝试），默认2次
     send_forward_msg: bool = True    # 使用合并转发来发图，默认开启
+    image_delivery: str = 'bytes'    # 结果图片发送方式，可选 bytes（内联）, file（本地路径）, http（内置 HTTP 地址）
+    delivery_base_url: str = ''    # http 模式下 OneBot 实现访问 Bot 的地址，如 http://127.0.0.1:8080，留空使用 HOST:PORT
+    output_ttl: int = 3600    # file/http 模式下输出图片的保留时间（秒）
+    metrics_path: str = ''    # Prometheus 指标的 HTTP 路径（如 /templates_draw/metrics），留空不注册；该路由无鉴权，请只在内网暴露
+    trace_enabled: bool = True    # 记录每次画图各阶段的耗时，供 绘图追踪 命令和导出使用
+    trace_slow_threshold: float = 30    # 总耗时超过该值（秒）的请求记为慢请求
+    trace_keep: int = 20    # 保留的最近慢请求数
+    trace_export: str = ''    # OTLP/JSON 导出目标：文件路径（每行一个请求）或 collector 地址，留空不导出
 
     doubao_api_url: str = 'https://ark.cn-beijing.volces.com/api/v3'
     doubao_model: str = 'doubao-seedream-4-5-251128'
     sequential_image_generation: bool = False   # 是否顺序生成图片（多图分别生成），默认为 False（多图生成单图）
+    sequential_max_concurrency: int = 3    # 多图分别生成时的最大并发数，设为 1 即逐张生成
+    stream_response: bool = False    # 使用流式响应（Gemini streamGenerateContent / OpenAI stream），文本会先行发送，豆包不支持
+    max_concurrent_global: int = 6    # 全局同时进行的画图任务数，0 为不限制
+    max_concurrent_per_group: int = 2    # 单个群同时进行的画图任务数，0 为不限制
+    max_queue_size: int = 20    # 排队任务数上限，超出直接拒绝，0 为不限制
+    request_dedup_enabled: bool = True    # 同时进行的相同请求（模板、图片、模型都相同）只生成一次
+    result_cache_ttl: int = 0    # 相同请求的结果缓存时长（秒），0 为不缓存
+
+    request_timeout: float = 120    # 上游请求超时（秒）
+    http_max_connections: int = 20    # 每个上游主机的最大连接数
+    http_max_keepalive_connections: int = 10    # 每个上游主机保持的空闲长连接数
+    http_keepalive_expiry: float = 30    # 空闲长连接的保活时间（秒）
+    http2_enabled: bool = False    # 启用 HTTP/2，需要安装 httpx[http2]
+
+    key_cooldown_seconds: float = 60    # Key 被限流（429）且无 Retry-After 时的冷却时间（秒）
+    key_timeout_cooldown_seconds: float = 10    # Key 请求超时后的冷却时间（秒）
+    key_quarantine_threshold: int = 3    # Key 连续鉴权失败（401/403）多少次后隔离
+    key_quarantine_seconds: float = 1800    # Key 被隔离的时长（秒）
+
+    hedge_enabled: bool = False    # 请求过慢时用另一个 Key 发起对冲请求，先返回者胜出
+    hedge_percentile: float = 90    # 对冲延迟取最近成功请求耗时的百分位
+    hedge_initial_delay: float = 30    # 样本不足时的对冲延迟（秒）
+    hedge_max_per_minute: int = 10    # 每分钟最多发起的对冲请求数
+
+    image_worker_type: str = 'thread'    # 图片/PDF 处理执行器类型，可选 thread, process（仅支持 fork 的平台，Windows 回退为 thread）
+    image_worker_count: int = 0    # 执行器工作线程/进程数，0 为自动（最多 4 个）
+
+    input_max_edge: int = 2048    # 参考图最长边上限（像素），超出等比缩小，0 为不缩放
+    input_image_format: str = 'auto'    # 参考图编码格式，可选 auto, png, jpeg, webp；auto 选择体积最小的
+    input_image_quality: int = 90    # JPEG/WebP 编码质量
+    input_max_total_mb: float = 15    # 单次请求所有参考图编码后的总大小上限（MB），0 为不限制
+
+    download_concurrency: int = 4    # 获取参考图/头像时的最大并发下载数
+    download_timeout: float = 15    # 单张参考图/头像下载解码的超时时间（秒）
+    result_download_concurrency: int = 4    # 上游返回图片 URL 时的最大并发下载数
+    result_download_timeout: float = 60    # 单张生成结果下载的超时时间（秒）
+    result_download_retries: int = 2    # 生成结果下载失败（网络异常、429、5xx）的重试次数
+    result_max_mb: float = 30    # 单张生成结果的大小上限（MB），0 为不限制
+
+    image_cache_enabled: bool = True    # 缓存头像和消息图片
+    image_cache_ttl: int = 3600    # 缓存有效期（秒），过期后用 ETag/Last-Modified 校验
+    image_cache_max_mb: float = 200    # 磁盘缓存上限（MB），超出按最近访问时间淘汰
+    image_cache_memory_items: int = 64    # 内存中保留的已解码图片数
+    image_cache_memory_mb: float = 256    # 内存中已解码图片的总大小上限（MB，按 宽×高×通道数 估算）
+
+    template_write_delay: float = 1.0    # 模板修改合并写回 prompt.json 的延迟（秒）
+    gallery_page_size: int = 20    # 查看模板时每页显示的模板数，0 为不分页
+    gallery_columns: int = 1    # 模板列表图片的列数
 
 
     prompt_手办化1: str  = "Using the nano-banana model, a commercial 1/7 scale figurine of the character in the picture was created, depicting a realistic style and a realistic environment. The figurine is placed on a computer desk with a round transparent acrylic base. There is no text on the base. The computer screen shows the Zbrush modeling process of the figurine. Next to the computer screen is a BANDAI-style toy box with the original painting printed on it. Picture ratio 16:9."
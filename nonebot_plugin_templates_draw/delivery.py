@@ -0,0 +1,123 @@
+import re, time, hashlib
+from pathlib import Path
+from typing import Optional
+
+from nonebot import logger, get_driver, require, get_plugin_config
+from nonebot.drivers import URL, ASGIMixin, HTTPServerSetup, Request, Response
+from nonebot.adapters.onebot.v11 import MessageSegment
+require("nonebot_plugin_localstore")
+from nonebot_plugin_localstore import get_plugin_cache_dir
+
+from .config import Config
+from .workers import run_in_worker
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+# 生成结果的输出目录，file / http 模式下 OneBot 实现从这里读取图片
+OUTPUT_DIR: Path = Path(get_plugin_cache_dir()) / "outputs"
+OUTPUT_ROUTE = "/templates_draw/outputs"
+
+_NAME_PATTERN = re.compile(r"^[0-9a-f]{40}\.(png|jpg|gif|webp)$")
+_CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+
+# 两次过期清理之间的最短间隔（秒）
+_CLEANUP_INTERVAL = 60
+_cleaned_at = 0.0
+_route_registered = False
+
+
+def _guess_ext(data: bytes) -> str:
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "png"
+
+
+def _cleanup_expired() -> None:
+    """删除超过 output_ttl 的输出文件"""
+    deadline = time.time() - plugin_config.output_ttl
+    for f in OUTPUT_DIR.glob("*"):
+        try:
+            if f.stat().st_mtime < deadline:
+                f.unlink()
+        except OSError:
+            pass
+
+
+def _write_output(data: bytes) -> Path:
+    global _cleaned_at
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    if plugin_config.output_ttl > 0 and now - _cleaned_at >= _CLEANUP_INTERVAL:
+        _cleaned_at = now
+        _cleanup_expired()
+    path = OUTPUT_DIR / f"{hashlib.sha1(data).hexdigest()}.{_guess_ext(data)}"
+    if not path.exists():
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    return path
+
+
+async def _handle_output(request: Request) -> Response:
+    name = request.url.query.get("id", "")
+    if not _NAME_PATTERN.match(name):
+        return Response(404, content="Not Found")
+    path = OUTPUT_DIR / name
+    try:
+        data = await run_in_worker(path.read_bytes)
+    except OSError:
+        return Response(404, content="Not Found")
+    return Response(
+        200,
+        headers={"Content-Type": _CONTENT_TYPES[name.rsplit(".", 1)[1]], "Cache-Control": "max-age=3600"},
+        content=data,
+    )
+
+
+def setup_output_route() -> None:
+    """http 模式下在驱动器上注册输出图片的访问路由"""
+    global _route_registered
+    if _route_registered or plugin_config.image_delivery != "http":
+        return
+    driver = get_driver()
+    if not isinstance(driver, ASGIMixin):
+        logger.warning("[templates-draw] 当前驱动器不支持 HTTP 服务，image_delivery=http 将回退为 bytes")
+        return
+    driver.setup_http_server(HTTPServerSetup(URL(OUTPUT_ROUTE), "GET", "templates_draw_outputs", _handle_output))
+    _route_registered = True
+
+
+def _output_url(path: Path) -> str:
+    base = plugin_config.delivery_base_url.rstrip("/")
+    if not base:
+        config = get_driver().config
+        base = f"http://{config.host}:{config.port}"
+    return f"{base}{OUTPUT_ROUTE}?id={path.name}"
+
+
+async def image_segment(img_bytes: Optional[bytes], img_url: Optional[str]) -> Optional[MessageSegment]:
+    """
+    按 image_delivery 构造图片消息段：
+    - bytes：直接内联 base64（默认）
+    - file：写入输出目录后发送 file:/// 路径，要求 OneBot 实现与 Bot 在同一台机器
+    - http：写入输出目录后发送插件内置 HTTP 路由的地址
+    """
+    if not img_bytes:
+        return MessageSegment.image(file=img_url) if img_url else None
+
+    mode = plugin_config.image_delivery
+    if mode == "http" and not _route_registered:
+        mode = "bytes"
+    if mode not in ("file", "http"):
+        return MessageSegment.image(file=img_bytes)
+
+    try:
+        path = await run_in_worker(_write_output, img_bytes)
+    except Exception as e:
+        logger.warning(f"[templates-draw] 写入输出图片失败，改为直接发送: {e}")
+        return MessageSegment.image(file=img_bytes)
+    return MessageSegment.image(file=path if mode == "file" else _output_url(path))
@@ -0,0 +1,86 @@
+import httpx
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from nonebot import logger, get_plugin_config
+
+from .config import Config
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+# 按上游主机划分的长连接客户端，key 为 scheme://host[:port]
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+# 测试/基准时可注入的 transport（例如 httpx.MockTransport）
+_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def _http2_available() -> bool:
+    """检测是否安装了 h2（httpx[http2]）"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=plugin_config.http_max_connections,
+        max_keepalive_connections=plugin_config.http_max_keepalive_connections,
+        keepalive_expiry=plugin_config.http_keepalive_expiry,
+    )
+    http2 = plugin_config.http2_enabled and _http2_available()
+    return httpx.AsyncClient(
+        timeout=plugin_config.request_timeout,
+        limits=limits,
+        http2=http2,
+        transport=_transport,
+    )
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """
+    获取 url 所属主机的共享客户端，不存在时创建。
+    同一主机的请求复用 keep-alive 连接，避免每次重新握手。
+    """
+    key = _host_key(url)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        client = _build_client()
+        _clients[key] = client
+        logger.debug(f"[templates-draw] 创建 HTTP 连接池: {key}")
+    return client
+
+
+def init_clients(
+    upstream_urls: Optional[list] = None,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> None:
+    """启动时预建上游连接池"""
+    global _transport
+    if transport is not None:
+        _transport = transport
+
+    if plugin_config.http2_enabled and not _http2_available():
+        logger.warning("[templates-draw] 已开启 http2_enabled 但未安装 h2，回退到 HTTP/1.1（pip install httpx[http2]）")
+
+    for url in upstream_urls or []:
+        if url:
+            get_client(url)
+
+
+async def close_clients() -> None:
+    """关闭时释放所有连接池"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"[templates-draw] 关闭 HTTP 连接池失败: {e}")
@@ -0,0 +1,242 @@
+import json, time, asyncio, hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+from nonebot import logger, require, get_plugin_config
+require("nonebot_plugin_localstore")
+from nonebot_plugin_localstore import get_plugin_cache_dir
+
+from .config import Config
+from .http_client import get_client
+from .preprocess import decode_image_bytes
+from .workers import run_in_worker
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+# 头像/消息图片的磁盘缓存目录：<sha1>.bin 为原始字节，<sha1>.json 为元数据
+IMAGE_CACHE_DIR: Path = Path(get_plugin_cache_dir()) / "images"
+
+# 解码后图片的内存 LRU：sha1 -> Image
+_memory: "OrderedDict[str, Image.Image]" = OrderedDict()
+# _memory 中图片按 宽×高×通道数 估算的总字节数
+_memory_bytes = 0
+# 磁盘条目元数据：sha1 -> {url, etag, last_modified, fetched_at, accessed_at, size}
+_index: Optional[Dict[str, Dict]] = None
+# 同一 URL 的并发请求共享一次下载
+_inflight: Dict[str, "asyncio.Future[Optional[Image.Image]]"] = {}
+
+
+def _cache_key(url: str) -> str:
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+def _scan_index() -> Dict[str, Dict]:
+    """扫描磁盘缓存目录，清理损坏的条目"""
+    index = {}
+    IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for meta_file in IMAGE_CACHE_DIR.glob("*.json"):
+        data_file = meta_file.with_suffix(".bin")
+        try:
+            meta = json.loads(meta_file.read_text("utf-8"))
+            meta["size"] = data_file.stat().st_size
+            meta["accessed_at"] = data_file.stat().st_mtime
+            index[meta_file.stem] = meta
+        except Exception:
+            meta_file.unlink(missing_ok=True)
+            data_file.unlink(missing_ok=True)
+    return index
+
+
+async def _load_index() -> Dict[str, Dict]:
+    """首次使用时在执行器中扫描磁盘缓存目录"""
+    global _index
+    if _index is None:
+        index = await run_in_worker(_scan_index)
+        # 并发的首次请求可能已经先完成扫描
+        if _index is None:
+            _index = index
+    return _index
+
+
+def _write_entry(key: str, data: Optional[bytes], meta: Dict) -> None:
+    """写入缓存条目（data 为 None 时只更新元数据）"""
+    if data is not None:
+        tmp = IMAGE_CACHE_DIR / f"{key}.bin.tmp"
+        tmp.write_bytes(data)
+        tmp.replace(IMAGE_CACHE_DIR / f"{key}.bin")
+    (IMAGE_CACHE_DIR / f"{key}.json").write_text(json.dumps(meta, ensure_ascii=False), "utf-8")
+
+
+def _remove_entries(keys: List[str]) -> None:
+    for key in keys:
+        (IMAGE_CACHE_DIR / f"{key}.bin").unlink(missing_ok=True)
+        (IMAGE_CACHE_DIR / f"{key}.json").unlink(missing_ok=True)
+
+
+def _image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def _forget(key: str) -> None:
+    global _memory_bytes
+    image = _memory.pop(key, None)
+    if image is not None:
+        _memory_bytes -= _image_bytes(image)
+
+
+def _remember(key: str, image: Image.Image) -> None:
+    """放入内存 LRU，超出条目数或总字节数上限时淘汰最久未用的图片"""
+    global _memory_bytes
+    limit = int(plugin_config.image_cache_memory_mb * 1024 * 1024)
+    size = _image_bytes(image)
+    _forget(key)
+    if size > limit:
+        return
+    _memory[key] = image
+    _memory_bytes += size
+    while len(_memory) > plugin_config.image_cache_memory_items or _memory_bytes > limit:
+        _forget(next(iter(_memory)))
+
+
+async def _evict(index: Dict[str, Dict]) -> None:
+    """磁盘缓存超出上限时，按最近访问时间淘汰，文件在执行器中删除"""
+    limit = int(plugin_config.image_cache_max_mb * 1024 * 1024)
+    total = sum(meta.get("size", 0) for meta in index.values())
+    if total <= limit:
+        return
+    victims: List[str] = []
+    for key, meta in sorted(index.items(), key=lambda item: item[1].get("accessed_at", 0)):
+        if total <= limit:
+            break
+        total -= meta.get("size", 0)
+        index.pop(key, None)
+        _forget(key)
+        victims.append(key)
+        logger.debug(f"[templates-draw] 淘汰图片缓存 {meta.get('url')}")
+    await run_in_worker(_remove_entries, victims)
+
+
+async def _cached_image(key: str) -> Optional[Image.Image]:
+    """从内存或磁盘取出已缓存的图片"""
+    image = _memory.get(key)
+    if image is not None:
+        _memory.move_to_end(key)
+        return image
+    data_file = IMAGE_CACHE_DIR / f"{key}.bin"
+    try:
+        data = await run_in_worker(data_file.read_bytes)
+        image = await run_in_worker(decode_image_bytes, data)
+    except Exception as e:
+        logger.debug(f"[templates-draw] 读取图片缓存失败 {data_file}: {e}")
+        return None
+    _remember(key, image)
+    return image
+
+
+async def _request(url: str, meta: Optional[Dict]) -> Tuple[int, Optional[bytes], Dict[str, str]]:
+    """发起（条件）请求，返回 (状态码, 内容, 响应头)"""
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    resp = await get_client(url).get(url, headers=headers, timeout=plugin_config.download_timeout)
+    content = resp.content if resp.status_code == 200 else None
+    return resp.status_code, content, dict(resp.headers)
+
+
+async def _fetch(url: str, key: str) -> Optional[Image.Image]:
+    index = await _load_index()
+    meta = index.get(key)
+    now = time.time()
+
+    if meta and now - meta.get("fetched_at", 0) < plugin_config.image_cache_ttl:
+        image = await _cached_image(key)
+        if image is not None:
+            meta["accessed_at"] = now
+            return image
+        meta = None
+
+    try:
+        status, content, headers = await _request(url, meta)
+    except Exception as e:
+        logger.warning(f"下载图片异常 {url}: {e}")
+        # 网络异常时，过期缓存也比没有好
+        return await _cached_image(key) if meta else None
+
+    if status == 304 and meta:
+        image = await _cached_image(key)
+        if image is not None:
+            meta.update(fetched_at=now, accessed_at=now)
+            await run_in_worker(_write_entry, key, None, meta)
+            logger.debug(f"[templates-draw] 图片缓存校验未变化 {url}")
+            return image
+        status, content, headers = await _request(url, None)
+
+    if status != 200 or not content:
+        logger.warning(f"下载图片失败 {url}: HTTP {status}")
+        return None
+
+    image = await run_in_worker(decode_image_bytes, content)
+    meta = {
+        "url": url,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "fetched_at": now,
+        "accessed_at": now,
+        "size": len(content),
+    }
+    try:
+        await run_in_worker(_write_entry, key, content, meta)
+        index[key] = meta
+        await _evict(index)
+    except Exception as e:
+        logger.warning(f"[templates-draw] 写入图片缓存失败 {url}: {e}")
+    _remember(key, image)
+    return image
+
+
+async def fetch_image(url: str) -> Optional[Image.Image]:
+    """
+    获取并解码图片，带内存 LRU 与磁盘缓存：
+    TTL 内直接使用缓存，过期后用 ETag / Last-Modified 做条件请求校验。
+    返回的 Image 可能被多个请求共享，调用方不应原地修改。
+    """
+    if not plugin_config.image_cache_enabled:
+        resp = await get_client(url).get(url, timeout=plugin_config.download_timeout)
+        if resp.status_code != 200:
+            logger.warning(f"下载图片失败 {url}: HTTP {resp.status_code}")
+            return None
+        return await run_in_worker(decode_image_bytes, resp.content)
+
+    key = _cache_key(url)
+    while True:
+        future = _inflight.get(key)
+        if future is None:
+            break
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 发起方被取消（如下载超时）时由当前请求接手下载，自身被取消则照常抛出
+            if not future.cancelled():
+                raise
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        image = await _fetch(url, key)
+        future.set_result(image)
+        return image
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # 避免无人等待时报 "exception was never retrieved"
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
@@ -0,0 +1,166 @@
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from nonebot import logger
+
+
+@dataclass
+class KeyState:
+    """单个 API Key 的健康状态"""
+    key: str
+    in_flight: int = 0
+    success: int = 0
+    failure: int = 0
+    consecutive_auth_failures: int = 0
+    cooldown_until: float = 0.0
+    quarantined_until: float = 0.0
+    last_used: float = 0.0
+    last_error: str = ""
+
+    def available_at(self) -> float:
+        return max(self.cooldown_until, self.quarantined_until)
+
+
+def mask_key(key: str) -> str:
+    """日志/统计中只展示 Key 首尾几位"""
+    if len(key) <= 10:
+        return key[:2] + "***"
+    return f"{key[:4]}...{key[-4:]}"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数和 HTTP 日期两种格式"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ApiKeyPool:
+    """
+    API Key 调度池：
+    - 429 后进入冷却（优先使用 Retry-After）
+    - 连续鉴权失败（401/403）达到阈值后隔离
+    - 超时后短暂冷却
+    - 在可用 Key 中选择进行中请求最少、最久未使用的
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        cooldown_seconds: float = 60,
+        timeout_cooldown_seconds: float = 10,
+        quarantine_threshold: int = 3,
+        quarantine_seconds: float = 1800,
+    ):
+        self._states: Dict[str, KeyState] = {k: KeyState(k) for k in keys}
+        if not self._states:
+            raise ValueError("API Key 列表为空")
+        self.cooldown_seconds = cooldown_seconds
+        self.timeout_cooldown_seconds = timeout_cooldown_seconds
+        self.quarantine_threshold = quarantine_threshold
+        self.quarantine_seconds = quarantine_seconds
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._states)
+
+    def has_healthy(self, exclude: Iterable[str] = ()) -> bool:
+        """除 exclude 外是否还有不在冷却/隔离中的 Key"""
+        now = time.monotonic()
+        excluded = set(exclude)
+        return any(s.available_at() <= now for s in self._states.values() if s.key not in excluded)
+
+    def acquire(self, exclude: Iterable[str] = ()) -> str:
+        """选出一个 Key 并计入进行中请求，用完必须调用 release"""
+        now = time.monotonic()
+        excluded = set(exclude)
+        candidates = [s for s in self._states.values() if s.key not in excluded] or list(self._states.values())
+
+        healthy = [s for s in candidates if s.available_at() <= now]
+        if healthy:
+            state = min(healthy, key=lambda s: (s.in_flight, s.last_used))
+        else:
+            # 全部冷却/隔离中，退而选最早恢复的，冷却优先于隔离
+            state = min(candidates, key=lambda s: (s.quarantined_until > now, s.available_at()))
+            logger.warning(
+                f"[templates-draw] 没有健康的 Key，使用最早恢复的 {mask_key(state.key)}"
+                f"（还需 {state.available_at() - now:.0f}s）"
+            )
+
+        state.in_flight += 1
+        state.last_used = now
+        return state.key
+
+    def release(
+        self,
+        key: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        timeout: bool = False,
+        error: str = "",
+    ) -> None:
+        """归还 Key，并根据本次结果更新健康状态"""
+        state = self._states.get(key)
+        if state is None:
+            return
+        state.in_flight = max(0, state.in_flight - 1)
+        now = time.monotonic()
+
+        if status_code == 200:
+            state.success += 1
+            state.consecutive_auth_failures = 0
+            return
+
+        if status_code is None and not timeout and not error:
+            # 请求未发出（例如被取消），不计入健康状态
+            return
+
+        state.failure += 1
+        state.last_error = error or (f"HTTP {status_code}" if status_code else "timeout")
+
+        if status_code == 429:
+            wait = retry_after if retry_after is not None else self.cooldown_seconds
+            state.cooldown_until = now + wait
+            logger.info(f"[templates-draw] Key {mask_key(key)} 触发限流，冷却 {wait:.0f}s")
+        elif status_code in (401, 403):
+            state.consecutive_auth_failures += 1
+            if state.consecutive_auth_failures >= self.quarantine_threshold:
+                state.quarantined_until = now + self.quarantine_seconds
+                logger.warning(
+                    f"[templates-draw] Key {mask_key(key)} 连续 {state.consecutive_auth_failures} 次鉴权失败，"
+                    f"隔离 {self.quarantine_seconds:.0f}s"
+                )
+        elif timeout:
+            state.cooldown_until = now + self.timeout_cooldown_seconds
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各 Key 的统计信息（Key 已脱敏）"""
+        now = time.monotonic()
+        result = []
+        for state in self._states.values():
+            if state.quarantined_until > now:
+                status = "quarantined"
+            elif state.cooldown_until > now:
+                status = "cooldown"
+            else:
+                status = "healthy"
+            result.append({
+                "key": mask_key(state.key),
+                "status": status,
+                "available_in": max(0.0, state.available_at() - now),
+                "in_flight": state.in_flight,
+                "success": state.success,
+                "failure": state.failure,
+                "last_error": state.last_error,
+            })
+        return result
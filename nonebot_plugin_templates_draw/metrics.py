@@ -0,0 +1,301 @@
+import abc, time, threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from nonebot import logger, get_driver, get_plugin_config
+from nonebot.drivers import URL, ASGIMixin, HTTPServerSetup, Request, Response
+
+from .config import Config
+from .scheduler import generation_scheduler
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+# 标签值元组 -> 数值；采集函数在抓取时返回当前值
+Samples = Dict[Tuple[str, ...], float]
+
+# 阶段耗时的分桶上限（秒），覆盖从缓存命中到上游超时的范围
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_route_registered = False
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._collect: Optional[Callable[[], Samples]] = None
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def collect_with(self, func: Callable[[], Samples]) -> None:
+        """抓取时调用 func 取值，用于队列深度、Key 统计等已有状态"""
+        self._collect = func
+
+    @abc.abstractmethod
+    def _lines(self) -> List[str]:
+        """指标的样本行（不含 HELP / TYPE）"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._lines()
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Samples = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Samples:
+        if self._collect is not None:
+            try:
+                return dict(self._collect())
+            except Exception as e:
+                logger.warning(f"[templates-draw] 采集指标 {self.name} 失败: {e}")
+                return {}
+        with self._lock:
+            return dict(self._values)
+
+    def total(self) -> float:
+        return sum(self.samples().values())
+
+    def _lines(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.samples().items())
+        ]
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """按 buckets 分桶统计的直方图"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # 标签值 -> (各桶计数（非累计）, 总和, 总数)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._series.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._series[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """记录 with 块的耗时，块内抛出异常也会记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """按桶线性插值估算分位数，与 PromQL 的 histogram_quantile 算法一致"""
+        series = self.snapshot().get(self._key(labels))
+        if not series or not series[2]:
+            return None
+        counts, _, count = series
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, n in zip(self.buckets, counts):
+            if cumulative + n >= rank and n:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / n
+            cumulative += n
+            lower = bound if bound != float("inf") else lower
+        return lower
+
+    def _lines(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """插件内的指标注册表，按注册顺序输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标 {metric.name} 已注册")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "templates_draw_stage_seconds",
+    "Latency of each draw stage: download, encode, upstream, parse, result_download, send.",
+    ["stage"],
+)
+ATTEMPTS = registry.counter(
+    "templates_draw_attempts_total", "Upstream requests sent, including hedged requests.", ["api_type"]
+)
+ERRORS = registry.counter(
+    "templates_draw_errors_total", "Failed attempts by exception class or failure kind (http, response, no_image, result_download) and HTTP status.", ["kind", "status"]
+)
+KEY_REQUESTS = registry.counter(
+    "templates_draw_key_requests_total", "Finished requests per API key (masked).", ["key", "result"]
+)
+BYTES_SENT = registry.counter("templates_draw_bytes_sent_total", "Request body bytes sent upstream.")
+BYTES_RECEIVED = registry.counter(
+    "templates_draw_bytes_received_total", "Response bytes received from upstream and result downloads.", ["source"]
+)
+QUEUE_DEPTH = registry.gauge("templates_draw_queue_depth", "Draw requests waiting for a generation slot.")
+RUNNING = registry.gauge("templates_draw_running", "Draw requests currently generating.")
+
+QUEUE_DEPTH.collect_with(lambda: {(): generation_scheduler.queue_depth})
+RUNNING.collect_with(lambda: {(): generation_scheduler.running})
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def format_summary() -> str:
+    """供管理员在聊天中查看的指标摘要"""
+    lines = [
+        "📊 绘图指标",
+        f"排队 {generation_scheduler.queue_depth} | 进行中 {generation_scheduler.running}",
+        f"上游请求 {ATTEMPTS.total():.0f} 次 | 失败 {ERRORS.total():.0f} 次",
+    ]
+
+    stages = STAGE_SECONDS.snapshot()
+    if stages:
+        lines.append("阶段耗时（次数 / 平均 / P95）：")
+        for (stage,), (_, total, count) in sorted(stages.items()):
+            lines.append(
+                f"- {stage}: {count} / {_format_seconds(total / count)} / "
+                f"{_format_seconds(STAGE_SECONDS.quantile(0.95, stage=stage))}"
+            )
+
+    errors = sorted(ERRORS.samples().items(), key=lambda item: -item[1])
+    if errors:
+        lines.append("错误分布：")
+        for (kind, status), value in errors[:8]:
+            lines.append(f"- {kind}{f' {status}' if status else ''}: {value:.0f}")
+
+    keys: Dict[str, Dict[str, float]] = {}
+    for (key, result), value in KEY_REQUESTS.samples().items():
+        keys.setdefault(key, {})[result] = value
+    if keys:
+        lines.append("Key 成功率：")
+        for key, counts in keys.items():
+            success, failure = counts.get("success", 0), counts.get("failure", 0)
+            rate = f"{success / (success + failure):.0%}" if success + failure else "-"
+            lines.append(f"- {key}: {rate}（{success:.0f}/{success + failure:.0f}）")
+
+    received = BYTES_RECEIVED.total() / 1024 / 1024
+    lines.append(f"流量：发送 {BYTES_SENT.total() / 1024 / 1024:.1f}MB / 接收 {received:.1f}MB")
+    return "\n".join(lines)
+
+
+async def _handle_metrics(request: Request) -> Response:
+    return Response(
+        200,
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        content=registry.render(),
+    )
+
+
+def setup_metrics_route() -> None:
+    """在驱动器上注册 Prometheus 抓取路由，metrics_path 为空时不注册"""
+    global _route_registered
+    if _route_registered or not plugin_config.metrics_path:
+        return
+    driver = get_driver()
+    if not isinstance(driver, ASGIMixin):
+        logger.debug("[templates-draw] 当前驱动器不支持 HTTP 服务，不注册指标路由")
+        return
+    driver.setup_http_server(
+        HTTPServerSetup(URL(plugin_config.metrics_path), "GET", "templates_draw_metrics", _handle_metrics)
+    )
+    _route_registered = True
@@ -0,0 +1,230 @@
+import copy, html, time, hashlib, threading
+from io import BytesIO
+from pathlib import Path
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from PIL import Image
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Paragraph
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.enums import TA_LEFT
+from reportlab.lib.utils import ImageReader
+
+from nonebot import logger, require, get_plugin_config
+require("nonebot_plugin_localstore")
+from nonebot_plugin_localstore import get_plugin_cache_dir
+
+from .config import Config
+from .preprocess import normalize_image
+from .workers import run_in_worker
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+PDF_FONT_PATH = Path(__file__).parent / "resources" / "fangsong_GB2312.ttf"
+# 生成 PDF 的缓存路径（pdf_cache_enabled 开启时才写入）
+PDF_CACHE_DIR: Path = Path(get_plugin_cache_dir()) / "pdf"
+# 旧版本直接写在缓存根目录下的 PDF，清理时一并处理
+_LEGACY_PDF_DIR: Path = Path(get_plugin_cache_dir())
+
+# 提示词正文区域：页边距 40，顶部留出 60 给标题，再减去 Frame 默认的 6pt 内边距
+_PROMPT_X = 40 + 6
+_PROMPT_TOP = A4[1] - 60 - 6
+_PROMPT_WIDTH = A4[0] - 80 - 12
+_PROMPT_HEIGHT = A4[1] - 100 - 12
+# 已排版提示词段落的缓存数量
+_PROMPT_CACHE_SIZE = 64
+_prompt_cache: "OrderedDict[str, Optional[Tuple[Paragraph, float]]]" = OrderedDict()
+_prompt_lock = threading.Lock()
+
+_FONT_KEY = 'CustomChinese'
+_font_name: Optional[str] = None
+_font_lock = threading.Lock()
+
+
+def register_pdf_font() -> str:
+    """
+    注册 PDF 中文字体，每个进程只注册一次，返回可用的字体名。
+    ReportLab 的 TTFont 嵌入时只写入实际用到的字形子集。
+    """
+    global _font_name
+    if _font_name is not None:
+        return _font_name
+    with _font_lock:
+        if _font_name is not None:
+            return _font_name
+        font_name = 'Helvetica'  # 默认字体，加载失败时使用
+        try:
+            if PDF_FONT_PATH.exists():
+                pdfmetrics.registerFont(TTFont(_FONT_KEY, str(PDF_FONT_PATH)))
+                font_name = _FONT_KEY
+                logger.debug(f"PDF构建: 成功加载字体 {PDF_FONT_PATH}")
+            else:
+                logger.debug("PDF构建: 字体文件不存在，使用默认字体 (中文可能乱码)")
+        except Exception as e:
+            logger.error(f"PDF构建: 加载字体失败: {e}，使用默认字体")
+        _font_name = font_name
+    return _font_name
+
+
+def _to_jpeg(img: Image.Image) -> BytesIO:
+    """把参考图缩放并压缩为 JPEG，ReportLab 会直接嵌入 JPEG 数据而不重新编码"""
+    img = normalize_image(img, plugin_config.input_max_edge)
+    if img.mode == "RGBA":
+        background = Image.new("RGB", img.size, "#ffffff")
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    elif img.mode != "RGB" and img.mode != "L":
+        img = img.convert("RGB")
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=plugin_config.input_image_quality, optimize=True)
+    buf.seek(0)
+    return buf
+
+
+def _prompt_paragraph(prompt: str, font_name: str) -> Optional[Tuple[Paragraph, float]]:
+    """
+    排版好的提示词段落及其高度，按 (字体, 提示词) 缓存：同一模板的提示词页每次都相同，
+    缓存后只需把已排版的行直接画到新的画布上。放不下一页时返回 None。
+    """
+    key = hashlib.sha1(f"{font_name}\0{prompt}".encode()).hexdigest()
+    with _prompt_lock:
+        if key in _prompt_cache:
+            _prompt_cache.move_to_end(key)
+            return _prompt_cache[key]
+
+    style = ParagraphStyle(
+        'CustomStyle',
+        fontName=font_name,
+        fontSize=12,
+        leading=18, # 行间距稍微加大，更易阅读
+        alignment=TA_LEFT,
+        wordWrap='CJK' # 支持中文换行
+    )
+    # 先转义特殊字符，再转换换行符
+    safe_prompt = html.escape(prompt).replace('\n', '<br/>')
+    para = Paragraph(safe_prompt, style)
+    _, height = para.wrap(_PROMPT_WIDTH, _PROMPT_HEIGHT)
+    result = (para, height) if height <= _PROMPT_HEIGHT else None
+    if result is None:
+        logger.warning("PDF构建: 提示词超过一页，提示词页只保留标题")
+
+    with _prompt_lock:
+        _prompt_cache[key] = result
+        while len(_prompt_cache) > _PROMPT_CACHE_SIZE:
+            _prompt_cache.popitem(last=False)
+    return result
+
+
+def _draw_prompt_page(c: canvas.Canvas, prompt: str, font_name: str) -> None:
+    page_width, page_height = A4
+
+    # 标题
+    c.setFont(font_name, 16)
+    c.drawString(40, page_height - 50, "Prompt:")
+
+    # 正文：与 Frame(40, 40, 宽-80, 高-100) 中的排版位置一致，从区域顶部向下排
+    cached = _prompt_paragraph(prompt, font_name)
+    if cached is not None:
+        para, height = cached
+        # drawOn 会临时把画布挂到段落对象上，浅拷贝后再画，避免多个线程共用同一对象
+        copy.copy(para).drawOn(c, _PROMPT_X, _PROMPT_TOP - height)
+    c.showPage()
+
+
+def _draw_image_page(c: canvas.Canvas, img: Image.Image, idx: int, total: int, font_name: str) -> None:
+    page_width, page_height = A4
+    margin = 20           # 左右边距
+    bottom_text_area = 50 # 底部留给文字的高度
+    top_margin = 20       # 顶部边距
+
+    # 1. 计算图片最大可用区域
+    available_width = page_width - (margin * 2)
+    available_height = page_height - top_margin - bottom_text_area
+
+    reader = ImageReader(_to_jpeg(img))
+    img_width, img_height = reader.getSize()
+
+    # 2. 计算缩放比例 (保持纵横比，contain 模式)
+    scale = min(available_width / img_width, available_height / img_height)
+    new_width = img_width * scale
+    new_height = img_height * scale
+
+    # 3. 居中，并保证图片位于底部文字区域之上
+    x = (page_width - new_width) / 2
+    y = bottom_text_area + (available_height - new_height) / 2
+
+    # 4. 绘制图片与底部文字
+    c.drawImage(reader, x, y, width=new_width, height=new_height)
+    c.setFont(font_name, 10)
+    c.drawCentredString(page_width / 2, 30, f"Reference Image {idx + 1} / {total}")
+    c.showPage()
+
+
+def prune_pdf_cache() -> None:
+    """按 pdf_cache_max_age 删除过期 PDF，再按修改时间淘汰到 pdf_cache_max_mb 以内"""
+    files = []
+    for path in [*PDF_CACHE_DIR.glob("*.pdf"), *_LEGACY_PDF_DIR.glob("*.pdf")]:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    deadline = time.time() - plugin_config.pdf_cache_max_age
+    limit = int(plugin_config.pdf_cache_max_mb * 1024 * 1024)
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in sorted(files):
+        if mtime >= deadline and total <= limit:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def _persist(pdf_bytes: bytes) -> None:
+    try:
+        PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        file_path = PDF_CACHE_DIR / f"{hashlib.sha1(pdf_bytes).hexdigest()}.pdf"
+        file_path.write_bytes(pdf_bytes)
+        logger.info(f"PDF已保存: {file_path} ({len(pdf_bytes)} bytes)")
+        prune_pdf_cache()
+    except Exception as e:
+        # 保存失败不影响本次请求
+        logger.warning(f"PDF保存失败: {e}")
+
+
+def build_pdf_from_prompt_and_images(prompt: str, images: List[Image.Image]) -> bytes:
+    """
+    将提示词和多个 PIL Image 对象合并为一个 PDF 文件，全程在内存中完成。
+    pdf_cache_enabled 开启时额外保存一份到缓存目录，便于排查。
+    """
+    if not prompt and not images:
+        raise ValueError("提示词和图片不能都为空")
+
+    font_name = register_pdf_font()
+    pdf_buffer = BytesIO()
+    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+
+    # 第一页：Prompt
+    if prompt:
+        _draw_prompt_page(c, prompt, font_name)
+
+    # 后续页面：Images
+    for idx, img in enumerate(images):
+        _draw_image_page(c, img, idx, len(images), font_name)
+
+    c.save()
+    pdf_bytes = pdf_buffer.getvalue()
+    logger.debug(f"PDF构建成功 ({len(pdf_bytes)} bytes)")
+
+    if plugin_config.pdf_cache_enabled:
+        _persist(pdf_bytes)
+    return pdf_bytes
+
+
+async def build_pdf_async(prompt: str, images: List[Image.Image]) -> bytes:
+    """在执行器中构建 PDF，不阻塞事件循环"""
+    return await run_in_worker(build_pdf_from_prompt_and_images, prompt, images)
@@ -0,0 +1,107 @@
+import base64
+from io import BytesIO
+from typing import List, Tuple
+
+from PIL import Image, ImageOps, features
+
+# 小于该像素数的图片在 auto 模式下也会尝试无损 PNG（图标、表情包等通常 PNG 更小）
+_PNG_CANDIDATE_MAX_PIXELS = 1024 * 1024
+
+_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def decode_image_bytes(data: bytes) -> Image.Image:
+    """
+    解码图片字节并立即加载像素数据。
+    动图在这里就只保留第一帧：解码结果会进入内存缓存、被多个线程共享，之后不能再 seek。
+    """
+    image = Image.open(BytesIO(data))
+    image.load()
+    if getattr(image, "is_animated", False):
+        image = image.copy()
+    return image
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    if image.mode not in ("RGBA", "LA"):
+        return False
+    return image.getchannel("A").getextrema()[0] < 255
+
+
+def normalize_image(image: Image.Image, max_edge: int = 0) -> Image.Image:
+    """
+    统一图片方向、色彩模式和尺寸：
+    - 按 EXIF 方向旋转
+    - 动图只取当前帧（decode_image_bytes 得到的已是第一帧），不会原地修改传入的图片
+    - 调色板/灰度透明/CMYK/16 位等模式转换为 RGB(A)，完全不透明的 RGBA 去掉 Alpha
+    - 最长边超过 max_edge 时等比缩小（max_edge 为 0 不缩放）
+    """
+    if getattr(image, "is_animated", False):
+        image = image.copy()
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    elif image.mode == "LA":
+        image = image.convert("RGBA")
+    elif image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+
+    if image.mode == "RGBA" and not _has_alpha(image):
+        image = image.convert("RGB")
+
+    if max_edge and max(image.size) > max_edge:
+        scale = max_edge / max(image.size)
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(new_size, Image.LANCZOS)
+
+    return image
+
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = BytesIO()
+    if fmt == "PNG":
+        image.save(buf, format="PNG")
+    elif fmt == "JPEG":
+        image.save(buf, format="JPEG", quality=quality, optimize=True)
+    else:
+        image.save(buf, format="WEBP", quality=quality, method=4)
+    return buf.getvalue()
+
+
+def _candidate_formats(image: Image.Image, fmt: str) -> List[str]:
+    webp = features.check("webp")
+    alpha = image.mode == "RGBA"
+    fmt = fmt.upper()
+
+    if fmt == "PNG":
+        return ["PNG"]
+    if fmt == "JPEG":
+        # JPEG 不支持透明，透明图回退到 PNG
+        return ["PNG"] if alpha else ["JPEG"]
+    if fmt == "WEBP":
+        return ["WEBP"] if webp else ["PNG"]
+
+    # auto：有损格式为主，小图额外比较 PNG
+    candidates = []
+    if not alpha:
+        candidates.append("JPEG")
+    if webp:
+        candidates.append("WEBP")
+    if alpha or image.width * image.height <= _PNG_CANDIDATE_MAX_PIXELS:
+        candidates.append("PNG")
+    return candidates
+
+
+def prepare_image(image: Image.Image, max_edge: int, fmt: str = "auto", quality: int = 90) -> Tuple[str, str, int]:
+    """
+    预处理并编码单张图片，返回 (mime_type, base64, 处理后最长边)。
+    fmt 可选 auto, png, jpeg, webp；auto 会在候选格式中选择体积最小的。
+    """
+    image = normalize_image(image, max_edge)
+    best_fmt, best_data = "", b""
+    for candidate in _candidate_formats(image, fmt):
+        data = _encode(image, candidate, quality)
+        if not best_data or len(data) < len(best_data):
+            best_fmt, best_data = candidate, data
+    return _MIME_TYPES[best_fmt], base64.b64encode(best_data).decode(), max(image.size)
@@ -0,0 +1,149 @@
+import json, time, asyncio, hashlib
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+from nonebot import logger, require, get_plugin_config
+require("nonebot_plugin_localstore")
+from nonebot_plugin_localstore import get_plugin_cache_dir
+
+from .config import Config
+from .workers import run_in_worker
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+Results = List[Tuple[Optional[bytes], Optional[str], Optional[str]]]
+
+# 生成结果的磁盘缓存目录：<key>.json 为元数据，<key>_<n>.bin 为图片
+RESULT_CACHE_DIR: Path = Path(get_plugin_cache_dir()) / "results"
+
+# 正在进行的相同请求：key -> 结果
+_inflight: Dict[str, "asyncio.Future[Results]"] = {}
+
+
+def _image_digest(image: Image.Image) -> str:
+    h = hashlib.sha1(f"{image.mode}:{image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+async def request_key(identifier: str, prompt: str, images: List[Image.Image]) -> str:
+    """由模板、提示词、输入图片内容和模型生成请求指纹"""
+    digests = await asyncio.gather(*(run_in_worker(_image_digest, img) for img in images))
+    api_type = plugin_config.api_type.lower()
+    model = plugin_config.doubao_model if api_type == "doubao" else plugin_config.gemini_model
+    parts = [
+        identifier,
+        hashlib.sha1(prompt.encode()).hexdigest(),
+        *digests,
+        api_type,
+        model,
+        str(plugin_config.sequential_image_generation),
+        str(plugin_config.gemini_pdf_jailbreak),
+    ]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def _load(key: str) -> Optional[Results]:
+    meta_file = RESULT_CACHE_DIR / f"{key}.json"
+    try:
+        meta = json.loads(meta_file.read_text("utf-8"))
+    except (OSError, ValueError):
+        return None
+    if time.time() - meta.get("created_at", 0) >= plugin_config.result_cache_ttl:
+        return None
+    results: Results = []
+    try:
+        for item in meta["items"]:
+            data = (RESULT_CACHE_DIR / item["file"]).read_bytes() if item.get("file") else None
+            results.append((data, item.get("url"), item.get("text")))
+    except (OSError, KeyError):
+        return None
+    return results
+
+
+def _purge_expired() -> None:
+    now = time.time()
+    for meta_file in RESULT_CACHE_DIR.glob("*.json"):
+        try:
+            created_at = json.loads(meta_file.read_text("utf-8")).get("created_at", 0)
+        except (OSError, ValueError):
+            created_at = 0
+        if now - created_at >= plugin_config.result_cache_ttl:
+            for f in RESULT_CACHE_DIR.glob(f"{meta_file.stem}*"):
+                f.unlink(missing_ok=True)
+
+
+def _store(key: str, results: Results) -> None:
+    RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _purge_expired()
+    items = []
+    for i, (data, url, text) in enumerate(results):
+        item = {"url": url, "text": text}
+        if data:
+            item["file"] = f"{key}_{i}.bin"
+            (RESULT_CACHE_DIR / item["file"]).write_bytes(data)
+        items.append(item)
+    # 元数据最后写入，读到元数据时图片一定已经写完
+    tmp = RESULT_CACHE_DIR / f"{key}.json.tmp"
+    tmp.write_text(json.dumps({"created_at": time.time(), "items": items}, ensure_ascii=False), "utf-8")
+    tmp.replace(RESULT_CACHE_DIR / f"{key}.json")
+
+
+def _cacheable(results: Results) -> bool:
+    # 只缓存每一项都有图片的结果，部分失败的结果下次应重新生成
+    return bool(results) and all(data or url for data, url, _ in results)
+
+
+async def shared_generation(
+    key: str,
+    generate: Callable[[], Awaitable[Results]],
+    on_join: Optional[Callable[[], Awaitable[object]]] = None,
+) -> Results:
+    """
+    相同请求只调用一次上游：
+    - result_cache_ttl > 0 时，有效期内的相同请求直接返回磁盘缓存
+    - 已有相同请求在生成时，等待其结果（不占用排队位置），并先调用 on_join
+    """
+    if plugin_config.result_cache_ttl > 0:
+        cached = await run_in_worker(_load, key)
+        if cached is not None:
+            logger.debug(f"[templates-draw] 命中结果缓存 {key[:12]}")
+            return cached
+
+    while True:
+        future = _inflight.get(key)
+        if future is None:
+            break
+        if on_join is not None:
+            await on_join()
+            on_join = None
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 发起方被取消时由当前请求重新发起，自身被取消则照常抛出
+            if not future.cancelled():
+                raise
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        results = await generate()
+        future.set_result(results)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # 避免无人等待时报 "exception was never retrieved"
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+    if plugin_config.result_cache_ttl > 0 and _cacheable(results):
+        try:
+            await run_in_worker(_store, key, results)
+        except Exception as e:
+            logger.warning(f"[templates-draw] 写入结果缓存失败: {e}")
+    return results
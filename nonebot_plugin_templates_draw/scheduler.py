@@ -0,0 +1,132 @@
+import asyncio, itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from nonebot import logger, get_plugin_config
+
+from .config import Config
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+
+class QueueFullError(RuntimeError):
+    """排队人数已满"""
+
+
+@dataclass
+class _Ticket:
+    seq: int
+    group_id: int
+    user_id: int
+    future: "asyncio.Future[None]" = field(repr=False)
+
+
+class GenerationScheduler:
+    """
+    画图任务调度：
+    - 全局与单群并发上限（0 为不限制）
+    - 超出上限的任务进入 FIFO 队列，队列满时直接拒绝
+    - 有空位时优先放行当前进行中任务最少的用户，同等情况下先到先得
+    """
+
+    def __init__(self, global_limit: int, group_limit: int, max_queue: int):
+        self.global_limit = global_limit
+        self.group_limit = group_limit
+        self.max_queue = max_queue
+        self._running = 0
+        self._running_group: Dict[int, int] = {}
+        self._running_user: Dict[int, int] = {}
+        self._queue: List[_Ticket] = []
+        self._seq = itertools.count()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def _can_run(self, group_id: int) -> bool:
+        if self.global_limit and self._running >= self.global_limit:
+            return False
+        if self.group_limit and self._running_group.get(group_id, 0) >= self.group_limit:
+            return False
+        return True
+
+    def _acquire(self, group_id: int, user_id: int) -> None:
+        self._running += 1
+        self._running_group[group_id] = self._running_group.get(group_id, 0) + 1
+        self._running_user[user_id] = self._running_user.get(user_id, 0) + 1
+
+    def _release(self, group_id: int, user_id: int) -> None:
+        self._running -= 1
+        for counter, key in ((self._running_group, group_id), (self._running_user, user_id)):
+            counter[key] -= 1
+            if counter[key] <= 0:
+                counter.pop(key)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """把空出的位置分给队列中可运行的任务"""
+        while self._queue:
+            eligible = [t for t in self._queue if self._can_run(t.group_id)]
+            if not eligible:
+                return
+            ticket = min(eligible, key=lambda t: (self._running_user.get(t.user_id, 0), t.seq))
+            self._queue.remove(ticket)
+            self._acquire(ticket.group_id, ticket.user_id)
+            ticket.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        group_id: int,
+        user_id: int,
+        on_queued: Optional[Callable[[int], Awaitable[Any]]] = None,
+    ) -> AsyncIterator[None]:
+        """
+        占用一个生成位置，需要排队时先调用 on_queued(排队位次)。
+        队列已满时抛出 QueueFullError。
+        """
+        if not self._queue and self._can_run(group_id):
+            self._acquire(group_id, user_id)
+        else:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                raise QueueFullError(f"当前排队人数已满（{self.max_queue}），请稍后再试")
+
+            ticket = _Ticket(next(self._seq), group_id, user_id, asyncio.get_running_loop().create_future())
+            self._queue.append(ticket)
+            # 队列里可能只有其他群被单群上限卡住的任务，全局仍有空位时直接放行
+            self._dispatch()
+
+            try:
+                if not ticket.future.done():
+                    position = self._queue.index(ticket) + 1
+                    logger.debug(f"[templates-draw] 群 {group_id} 用户 {user_id} 进入队列，第 {position} 位")
+                    if on_queued is not None:
+                        try:
+                            await on_queued(position)
+                        except Exception as e:
+                            logger.warning(f"排队提示发送失败: {e}")
+                await ticket.future
+            except asyncio.CancelledError:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                elif ticket.future.done() and not ticket.future.cancelled():
+                    # 刚被放行就被取消，归还位置
+                    self._release(group_id, user_id)
+                raise
+
+        try:
+            yield
+        finally:
+            self._release(group_id, user_id)
+
+
+generation_scheduler = GenerationScheduler(
+    plugin_config.max_concurrent_global,
+    plugin_config.max_concurrent_per_group,
+    plugin_config.max_queue_size,
+)
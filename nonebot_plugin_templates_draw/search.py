@@ -0,0 +1,98 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # 未安装 pypinyin 时不支持拼音匹配
+    lazy_pinyin = None
+
+# 各类匹配的得分，分数越高越靠前
+SCORE_EXACT = 100
+SCORE_PREFIX = 90
+SCORE_SUBSTRING = 80
+SCORE_PINYIN_INITIALS = 70
+SCORE_PINYIN_FULL = 60
+SCORE_TYPO = 50
+SCORE_CONTENT = 30
+
+# 达到该分数的匹配视为命中了模板名（而不是仅内容相关）
+NAME_MATCH_SCORE = SCORE_PINYIN_FULL
+
+
+class _Entry(NamedTuple):
+    name: str
+    lower: str
+    initials: str
+    full_pinyin: str
+    content: str
+
+
+def _pinyin(text: str) -> Tuple[str, str]:
+    """返回 (拼音首字母, 全拼)，未安装 pypinyin 时为空"""
+    if lazy_pinyin is None:
+        return "", ""
+    initials = "".join(lazy_pinyin(text, style=Style.FIRST_LETTER)).lower()
+    full = "".join(lazy_pinyin(text)).lower()
+    return initials, full
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein 距离，超过 limit 时提前返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class TemplateSearchIndex:
+    """
+    模板搜索索引：对模板名做子串、拼音首字母/全拼（需要 pypinyin）和编辑距离匹配，
+    对提示词内容做子串匹配，返回按得分排序的结果。
+    """
+
+    def __init__(self, templates: Dict[str, str]):
+        self.entries: List[_Entry] = []
+        for name, content in templates.items():
+            initials, full = _pinyin(name)
+            self.entries.append(_Entry(name, name.lower(), initials, full, content.lower()))
+
+    def _score(self, entry: _Entry, query: str) -> int:
+        if entry.lower == query:
+            return SCORE_EXACT
+        if entry.lower.startswith(query):
+            return SCORE_PREFIX
+        if query in entry.lower:
+            return SCORE_SUBSTRING
+        if query.isascii() and query.isalnum():
+            if entry.initials and query in entry.initials:
+                return SCORE_PINYIN_INITIALS
+            if entry.full_pinyin and query in entry.full_pinyin:
+                return SCORE_PINYIN_FULL
+        # 允许的错字数随长度增加，单字查询不做纠错
+        limit = len(query) // 3 or (1 if len(query) > 1 else 0)
+        if limit:
+            # 与完整模板名或等长前缀比较，兼容只输入了前半部分又打错字的情况
+            distance = edit_distance(query, entry.lower, limit)
+            if distance <= limit:
+                return SCORE_TYPO - distance
+            distance = edit_distance(query, entry.lower[:len(query)], limit)
+            if distance <= limit:
+                return SCORE_TYPO - distance - 5
+        if len(query) > 1 and query in entry.content:
+            return SCORE_CONTENT
+        return 0
+
+    def search(self, query: str, limit: Optional[int] = 10) -> List[Tuple[str, int]]:
+        """返回 [(模板名, 得分)]，按得分从高到低、同分按模板顺序排列"""
+        query = query.strip().lower()
+        if not query:
+            return []
+        scored = [(entry.name, self._score(entry, query)) for entry in self.entries]
+        results = sorted((item for item in scored if item[1] > 0), key=lambda item: -item[1])
+        return results[:limit] if limit else results
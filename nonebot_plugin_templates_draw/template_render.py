@@ -0,0 +1,220 @@
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+from PIL import Image, ImageDraw, ImageFont
+from nonebot import logger
+
+IMG_FONT_PATH = Path(__file__).parent / "resources" / "FZMINGSTJW.TTF"
+
+Font = Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]
+
+# 布局配置
+WIDTH = 400
+PADDING = 20
+HEADER_HEIGHT = 60
+FOOTER_HEIGHT = 140
+ITEM_SPACING = 15
+EMPTY_HEIGHT = 60
+# 单列模板项区块的宽度
+BLOCK_WIDTH = WIDTH - PADDING * 2
+# 预览每行的长度（以中文字符为 1，其他字符为 0.4）与最多行数
+PREVIEW_CHARS = 20
+PREVIEW_MAX_LINES = 3
+
+FOOTER_TIP = """使用 '查看模板 <模板标志>' 查看具体内容
+命令列表：
+- 画图 <模板标识> [图片]/@xxx
+- 添加/删除模板 <模板标识> <提示词>
+- 查看模板 或者 查看模板 <模板标识>"""
+FOOTER_TIP_PAGINATED = """使用 '查看模板 <模板标志>' 查看具体内容
+命令列表：
+- 画图 <模板标识> [图片]/@xxx
+- 添加/删除模板 <模板标识> <提示词>
+- 查看模板 [页码] 或者 查看模板 <模板标识>"""
+
+
+class Fonts(NamedTuple):
+    header: Font
+    item: Font
+    tip: Font
+
+
+@lru_cache(maxsize=1)
+def get_fonts() -> Fonts:
+    """加载字体，每个进程只加载一次"""
+    try:
+        if IMG_FONT_PATH.exists():
+            logger.debug(f"找到字体文件: {IMG_FONT_PATH}")
+            return Fonts(
+                ImageFont.truetype(str(IMG_FONT_PATH), 24),
+                ImageFont.truetype(str(IMG_FONT_PATH), 18),
+                ImageFont.truetype(str(IMG_FONT_PATH), 16),
+            )
+        raise FileNotFoundError(f"字体文件不存在: {IMG_FONT_PATH}")
+    except Exception as e:
+        logger.debug(f"加载包内字体失败: {e}")
+        default = ImageFont.load_default()
+        return Fonts(default, default, default)
+
+
+def _char_length(char: str) -> float:
+    return 1 if '\u4e00' <= char <= '\u9fff' else 0.4  # 中文字符为 1，其余为 0.4
+
+
+def wrap_text(text: str, max_chars: float = PREVIEW_CHARS) -> List[str]:
+    """文本换行，按字符长度分割"""
+    lines = []
+    current_line = ""
+    current_length = 0
+
+    for char in text:
+        char_length = _char_length(char)
+
+        if current_length + char_length > max_chars:
+            if current_line:
+                lines.append(current_line)
+                current_line = char
+                current_length = char_length
+            else:
+                lines.append(char)
+                current_line = ""
+                current_length = 0
+        else:
+            current_line += char
+            current_length += char_length
+
+    if current_line:
+        lines.append(current_line)
+
+    return lines
+
+
+def preview_lines(content: str) -> List[str]:
+    """模板内容的预览行：最多 3 行，超出时第 3 行截断并加 ..."""
+    preview = content.strip().replace("\n", " ")
+    all_lines = wrap_text(preview)
+    lines = all_lines[:PREVIEW_MAX_LINES]
+    if len(all_lines) > PREVIEW_MAX_LINES:
+        # 重新计算第3行的截断位置，确保加上"..."后不超出限制
+        line3_length = 0
+        truncated_line3 = ""
+        for char in lines[-1]:
+            char_length = _char_length(char)
+            if line3_length + char_length + 1.5 > PREVIEW_CHARS:
+                break
+            truncated_line3 += char
+            line3_length += char_length
+        lines[-1] = truncated_line3 + "..."
+    return lines
+
+
+def content_width(columns: int) -> int:
+    """columns 列模板项所占的宽度"""
+    return columns * BLOCK_WIDTH + (columns - 1) * ITEM_SPACING
+
+
+def _block(height: int, fill: str, outline: str, width: int = 1, block_width: int = 0) -> Image.Image:
+    """一个带边框的区块，默认宽度为单列模板项的宽度"""
+    block_width = block_width or BLOCK_WIDTH
+    img = Image.new('RGB', (block_width + 1, height + 1), '#ffffff')
+    ImageDraw.Draw(img).rectangle([0, 0, block_width, height], fill=fill, outline=outline, width=width)
+    return img
+
+
+@lru_cache(maxsize=64)
+def render_header(title: str = "当前模板列表", block_width: int = 0) -> Image.Image:
+    block_width = block_width or BLOCK_WIDTH
+    img = _block(HEADER_HEIGHT, '#e8eaf6', '#3f51b5', 2, block_width)
+    draw = ImageDraw.Draw(img)
+    font = get_fonts().header
+    bbox = draw.textbbox((0, 0), title, font=font)
+    w = bbox[2] - bbox[0]
+    h = bbox[3] - bbox[1]
+    x = (block_width + PADDING * 2 - w) // 2 - PADDING
+    draw.text((x, (HEADER_HEIGHT - h) // 2), title, fill='#1a237e', font=font)
+    return img
+
+
+@lru_cache(maxsize=8)
+def render_footer(block_width: int = 0, paginated: bool = False) -> Image.Image:
+    img = _block(FOOTER_HEIGHT, '#fff8e1', '#ff9800', 1, block_width)
+    draw = ImageDraw.Draw(img)
+    tip = FOOTER_TIP_PAGINATED if paginated else FOOTER_TIP
+    for i, line in enumerate(tip.split('\n')):
+        draw.text((8, 10 + i * 24), line, fill='#f57c00', font=get_fonts().tip)
+    return img
+
+
+@lru_cache(maxsize=8)
+def render_empty(block_width: int = 0) -> Image.Image:
+    img = _block(EMPTY_HEIGHT, '#f5f5f5', '#9e9e9e', 1, block_width)
+    ImageDraw.Draw(img).text((8, EMPTY_HEIGHT // 2 - 10), "暂无模板", fill='#757575', font=get_fonts().item)
+    return img
+
+
+@lru_cache(maxsize=1024)
+def render_item(name: str, content: str) -> Image.Image:
+    """
+    单个模板项的区块，按 (名称, 内容) 缓存：
+    模板增删改时只需重绘变化的区块，其余区块直接拼接。
+    返回的图片会被多次复用，调用方不应原地修改。
+    """
+    lines = preview_lines(content)
+    # 基础高度（模板名称行）+ 每行预览 20px + 10px 边距
+    height = 35 + len(lines) * 20 + 10
+    img = _block(height, '#f1f8e9', '#4caf50')
+    draw = ImageDraw.Draw(img)
+    fonts = get_fonts()
+    draw.text((8, 8), f"• {name}", fill='#2e7d32', font=fonts.item)
+    for j, line in enumerate(lines):
+        draw.text((8, 8 + 25 + j * 20), line, fill='#616161', font=fonts.tip)
+    return img
+
+
+def _stack(header: Image.Image, rows: List[List[Image.Image]], footer: Image.Image) -> Image.Image:
+    """把标题、按行排列的模板项和底部提示拼接到画布上，每行高度取该行最高的区块"""
+    # 区块本身比布局高度多 1px 边框
+    row_heights = [max(block.height for block in row) - 1 for row in rows]
+    width = header.width - 1 + PADDING * 2
+    height = (
+        PADDING + HEADER_HEIGHT + sum(row_heights) + max(len(rows) - 1, 0) * ITEM_SPACING
+        + FOOTER_HEIGHT + PADDING * 3
+    )
+    img = Image.new('RGB', (width, height), '#ffffff')
+    y = PADDING
+    img.paste(header, (PADDING, y))
+    y += HEADER_HEIGHT + ITEM_SPACING
+    for row, row_height in zip(rows, row_heights):
+        for col, block in enumerate(row):
+            img.paste(block, (PADDING + col * (BLOCK_WIDTH + ITEM_SPACING), y))
+        y += row_height + ITEM_SPACING
+    img.paste(footer, (PADDING, y + 10))
+    return img
+
+
+def paginate(templates: Dict[str, str], page_size: int) -> List[List[Tuple[str, str]]]:
+    """按 page_size 分页（0 为不分页），至少返回一页"""
+    items = list(templates.items())
+    if page_size <= 0 or not items:
+        return [items]
+    return [items[i:i + page_size] for i in range(0, len(items), page_size)]
+
+
+def create_gallery_page(items: List[Tuple[str, str]], page: int = 1, pages: int = 1, columns: int = 1) -> bytes:
+    """渲染模板列表的一页，返回 PNG 字节"""
+    columns = max(1, min(columns, len(items) or 1))
+    block_width = content_width(columns)
+    title = "当前模板列表" if pages <= 1 else f"当前模板列表（{page}/{pages}）"
+
+    if items:
+        blocks = [render_item(name, content) for name, content in items]
+        rows = [blocks[i:i + columns] for i in range(0, len(blocks), columns)]
+    else:
+        rows = [[render_empty(block_width)]]
+    img = _stack(render_header(title, block_width), rows, render_footer(block_width, pages > 1))
+
+    buf = BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
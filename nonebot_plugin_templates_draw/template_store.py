@@ -0,0 +1,251 @@
+import os, json, time, asyncio
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from nonebot import logger
+
+# 没有文件监听时，两次 mtime 检查之间的最短间隔（秒）
+_STAT_INTERVAL = 2.0
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    """先写临时文件再 rename，保证文件要么是旧内容要么是新内容"""
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _append_line(path: Path, line: str) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _truncate(path: Path) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class TemplateRegistry:
+    """
+    内存中的模板表：默认模板 + 用户模板合并后常驻内存，
+    文件被外部修改时（watchfiles 事件或 mtime 变化）自动重新加载。
+
+    用户模板的修改先写入日志文件（prompt.json.journal）再更新内存，
+    之后延迟 write_delay 秒合并写回 prompt.json；启动或重新加载时
+    会把日志中尚未写回的修改重放，避免崩溃丢失。
+    """
+
+    def __init__(self, default_file: Path, user_file: Path, write_delay: float = 1.0):
+        self.default_file = default_file
+        self.user_file = user_file
+        self.journal_file = user_file.with_name(user_file.name + ".journal")
+        self.write_delay = write_delay
+        # 模块导入时没有运行中的事件循环（3.9 的 Lock 会绑定到错误的循环），首次使用时再创建
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._defaults: Dict[str, str] = {}
+        self._users: Dict[str, str] = {}
+        self._merged: Dict[str, str] = {}
+        self._mtimes: Tuple[Optional[float], Optional[float]] = (None, None)
+        self._checked_at = 0.0
+        self._dirty = True
+        self._watch_task: Optional[asyncio.Task] = None
+        # 每次模板变化都会 +1，供渲染缓存、搜索索引判断是否需要重建
+        self.version = 0
+
+    # —— 读取 —— #
+    @staticmethod
+    def _mtime(path: Path) -> Optional[float]:
+        try:
+            return path.stat().st_mtime
+        except OSError:
+            return None
+
+    @staticmethod
+    def _read_json(path: Path) -> Dict[str, str]:
+        try:
+            return json.loads(path.read_text("utf-8"))
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            # 保留损坏的文件，避免下次写回时覆盖掉用户模板
+            backup = path.with_name(f"{path.name}.corrupt-{int(time.time())}")
+            try:
+                os.replace(path, backup)
+            except OSError:
+                backup = None
+            logger.error(f"[templates-draw] 读取 {path.name} 失败，已备份为 {backup}，返回空：{e}")
+            return {}
+
+    def _read_journal(self) -> List[Dict]:
+        try:
+            lines = self.journal_file.read_text("utf-8").splitlines()
+        except FileNotFoundError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 写到一半的最后一行
+                logger.warning(f"[templates-draw] 忽略损坏的模板日志记录: {line[:50]}")
+        return records
+
+    def _apply(self, record: Dict) -> None:
+        if record.get("op") == "set":
+            self._users[record["id"]] = record["prompt"]
+        elif record.get("op") == "remove":
+            self._users.pop(record["id"], None)
+
+    def _current_mtimes(self) -> Tuple[Optional[float], Optional[float]]:
+        return self._mtime(self.default_file), self._mtime(self.user_file)
+
+    def _rebuild(self) -> None:
+        self._merged = {
+            **self._defaults,
+            **{k: v.strip() for k, v in self._users.items() if v.strip()},
+        }
+        self.version += 1
+
+    def reload(self) -> None:
+        """从磁盘重新加载两个模板文件"""
+        self._mtimes = self._current_mtimes()
+        self._defaults = self._read_json(self.default_file)
+        self._users = self._read_json(self.user_file)
+        records = self._read_journal()
+        for record in records:
+            self._apply(record)
+        self._pending = len(records)
+        self._rebuild()
+        self._dirty = False
+        logger.debug(f"[templates-draw] 已加载 {len(self._merged)} 个模板")
+
+    def invalidate(self) -> None:
+        """标记缓存失效，下次访问时重新加载"""
+        self._dirty = True
+
+    def _ensure_fresh(self) -> None:
+        watching = self._watch_task is not None and not self._watch_task.done()
+        if not self._dirty and not watching:
+            # 未启用文件监听时，节流地检查 mtime
+            now = time.monotonic()
+            if now - self._checked_at >= _STAT_INTERVAL:
+                self._checked_at = now
+                if self._current_mtimes() != self._mtimes:
+                    self._dirty = True
+        if self._dirty:
+            self.reload()
+
+    def templates(self) -> Dict[str, str]:
+        """合并后的模板表（副本）"""
+        self._ensure_fresh()
+        return dict(self._merged)
+
+    def get(self, identifier: str) -> Optional[str]:
+        self._ensure_fresh()
+        return self._merged.get(identifier)
+
+    # —— 修改 —— #
+    @property
+    def _write_lock(self) -> asyncio.Lock:
+        """当前事件循环内的写锁"""
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    async def _commit(self, record: Dict) -> None:
+        """写日志 -> 更新内存 -> 安排延迟写回，调用方需持有锁"""
+        await asyncio.to_thread(_append_line, self.journal_file, json.dumps(record, ensure_ascii=False))
+        self._apply(record)
+        self._pending += 1
+        self._rebuild()
+        self._schedule_flush()
+
+    async def set(self, identifier: str, prompt_text: str) -> None:
+        async with self._write_lock:
+            self._ensure_fresh()
+            await self._commit({"op": "set", "id": identifier, "prompt": prompt_text.strip()})
+
+    async def remove(self, identifier: str) -> bool:
+        async with self._write_lock:
+            self._ensure_fresh()
+            if identifier not in self._users:
+                return False
+            await self._commit({"op": "remove", "id": identifier})
+            return True
+
+    def _schedule_flush(self) -> None:
+        # 已有待执行的写回时直接合并
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.write_delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"[templates-draw] 写回 {self.user_file.name} 失败，修改仍保留在日志中：{e}")
+
+    async def flush(self) -> None:
+        """把内存中的用户模板写回 prompt.json 并清空日志"""
+        async with self._write_lock:
+            if not self._pending:
+                return
+            text = json.dumps(self._users, ensure_ascii=False, indent=4)
+            await asyncio.to_thread(_atomic_write_text, self.user_file, text)
+            await asyncio.to_thread(_truncate, self.journal_file)
+            # 记录自己写入后的 mtime，避免被当成外部修改而重复加载
+            self._mtimes = self._current_mtimes()
+            logger.debug(f"[templates-draw] 已写回 {self._pending} 次模板修改")
+            self._pending = 0
+
+    # —— 文件监听 —— #
+    async def _watch(self, awatch) -> None:
+        watched = {str(self.default_file.resolve()), str(self.user_file.resolve())}
+        dirs = {self.user_file.parent, self.default_file.parent}
+        async for changes in awatch(*dirs):
+            if any(str(Path(path).resolve()) in watched for _, path in changes):
+                if self._current_mtimes() != self._mtimes:
+                    logger.debug("[templates-draw] 检测到模板文件变化，重新加载")
+                    self._dirty = True
+
+    def start_watching(self) -> None:
+        """有 watchfiles 时启动文件监听，否则回退到 mtime 检查"""
+        if self._watch_task is not None:
+            return
+        try:
+            from watchfiles import awatch
+        except ImportError:
+            logger.debug("[templates-draw] 未安装 watchfiles，模板文件变化通过 mtime 检查")
+            return
+        self._watch_task = asyncio.create_task(self._watch(awatch))
+
+    async def recover(self) -> None:
+        """启动时重放日志中未写回的修改并立即落盘"""
+        self._ensure_fresh()
+        if self._pending:
+            logger.info(f"[templates-draw] 从日志恢复 {self._pending} 次未写回的模板修改")
+            await self.flush()
+
+    async def close(self) -> None:
+        """停止文件监听并写回尚未落盘的修改"""
+        task, self._watch_task = self._watch_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
@@ -0,0 +1,274 @@
+import os, json, time, asyncio, functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar, Union
+
+from nonebot import logger, get_plugin_config
+from nonebot.exception import MatcherException
+
+from .config import Config
+from .http_client import get_client
+from .workers import run_in_worker
+from .metrics import STAGE_SECONDS
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+T = TypeVar("T")
+
+SERVICE_NAME = "nonebot-plugin-templates-draw"
+# 单个 trace 最多记录的 span 数，避免异常情况下无限增长
+_MAX_SPANS = 256
+# 慢请求输出时每个 trace 最多展示的 span 行数
+_MAX_DUMP_LINES = 30
+
+# OTLP 的 span 状态码
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+class Trace:
+    """一次请求（一个 trace）内的所有 span，trace_id 即请求 ID"""
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List["Span"] = []
+        self.root: Optional["Span"] = None
+
+    @property
+    def request_id(self) -> str:
+        return self.trace_id[:8]
+
+    def add(self, span: "Span") -> None:
+        if self.root is None:
+            self.root = span
+        if len(self.spans) < _MAX_SPANS:
+            self.spans.append(span)
+
+
+class Span:
+    """一个计时区间，attributes 记录负载大小、状态码等信息"""
+
+    def __init__(self, trace: Trace, name: str, parent_id: str, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        trace.add(self)
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update((k, v) for k, v in attributes.items() if v is not None)
+        return self
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        """结束 span，重复调用无效；matcher.finish 等流程控制异常不算错误"""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None and not isinstance(error, MatcherException):
+            self.error = (f"{type(error).__name__}: {error}" if str(error) else type(error).__name__)[:200]
+        if self is self.trace.root:
+            _on_trace_finished(self.trace)
+
+
+class _NoopSpan:
+    """未开启追踪时使用，所有操作都不做任何事"""
+    trace = None
+    duration = None
+
+    def set(self, **attributes: Any) -> "_NoopSpan":
+        return self
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+AnySpan = Union[Span, _NoopSpan]
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("templates_draw_span", default=None)
+# 最近的慢请求
+_slow_traces: "deque[Trace]" = deque(maxlen=max(1, plugin_config.trace_keep))
+# 进行中的导出任务，保留引用避免被回收
+_export_tasks: "set[asyncio.Task]" = set()
+
+
+def current_span() -> AnySpan:
+    return _current_span.get() or NOOP_SPAN
+
+
+def start_span(name: str, **attributes: Any) -> AnySpan:
+    """
+    开始一个 span（需要手动 end），父 span 为当前 span，没有时开始一个新的 trace。
+    不会成为当前 span，适合排队等待这类跨越 async with 的区间。
+    """
+    if not plugin_config.trace_enabled:
+        return NOOP_SPAN
+    parent = _current_span.get()
+    if parent is None:
+        return Span(Trace(), name, "", attributes)
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[AnySpan]:
+    """在 with 块内记录一个 span，并作为块内新 span 的父 span"""
+    current = start_span(name, **attributes)
+    if isinstance(current, _NoopSpan):
+        yield current
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+@contextmanager
+def stage(name: str, **attributes: Any) -> Iterator[AnySpan]:
+    """画图的一个阶段：同时记录阶段耗时指标和 span"""
+    with STAGE_SECONDS.time(stage=name), span(name, **attributes) as current:
+        yield current
+
+
+def traced(name: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """把整个异步函数记录为一个 span，保留原函数签名（NoneBot 依赖注入可用）"""
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _on_trace_finished(trace: Trace) -> None:
+    duration = trace.root.duration
+    logger.debug(f"[templates-draw] 请求 {trace.request_id} ({trace.root.name}) 完成，耗时 {duration:.2f}s")
+    if duration >= plugin_config.trace_slow_threshold:
+        _slow_traces.append(trace)
+    if not plugin_config.trace_export:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(_export(trace))
+    _export_tasks.add(task)
+    task.add_done_callback(_export_tasks.discard)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp(traces: List[Trace]) -> Dict[str, Any]:
+    """转换为 OTLP/JSON 的 ExportTraceServiceRequest，只包含已结束的 span"""
+    spans = []
+    for trace in traces:
+        for item in trace.spans:
+            if item.duration is None:
+                continue
+            data = {
+                "traceId": trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.start_ns + int(item.duration * 1e9)),
+                "attributes": _otlp_attributes(item.attributes),
+                "status": {"code": _STATUS_ERROR, "message": item.error} if item.error else {"code": _STATUS_OK},
+            }
+            if item.parent_id:
+                data["parentSpanId"] = item.parent_id
+            spans.append(data)
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+        "scopeSpans": [{"scope": {"name": __package__}, "spans": spans}],
+    }]}
+
+
+def _append_line(path: Path, line: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+async def _export(trace: Trace) -> None:
+    """
+    按 trace_export 导出：http(s) 地址视为 OTLP/HTTP collector（如 http://127.0.0.1:4318/v1/traces），
+    否则视为文件路径，每行追加一个 OTLP/JSON 请求体
+    """
+    target = plugin_config.trace_export
+    body = to_otlp([trace])
+    try:
+        if target.startswith(("http://", "https://")):
+            resp = await get_client(target).post(target, json=body, timeout=10)
+            if resp.status_code >= 300:
+                logger.warning(f"[templates-draw] 导出追踪数据失败: HTTP {resp.status_code}")
+        else:
+            await run_in_worker(_append_line, Path(target), json.dumps(body, ensure_ascii=False))
+    except Exception as e:
+        logger.warning(f"[templates-draw] 导出追踪数据失败: {e}")
+
+
+def _format_attributes(attributes: Dict[str, Any]) -> str:
+    if not attributes:
+        return ""
+    return " (" + ", ".join(f"{k}={v}" for k, v in attributes.items()) + ")"
+
+
+def format_trace(trace: Trace) -> str:
+    """按父子关系缩进展示一个 trace 的各个 span"""
+    children: Dict[str, List[Span]] = {}
+    for item in trace.spans:
+        children.setdefault(item.parent_id, []).append(item)
+
+    root = trace.root
+    started = time.strftime("%m-%d %H:%M:%S", time.localtime(root.start_ns / 1e9))
+    lines = [f"[{trace.request_id}] {started} 共 {root.duration:.2f}s{_format_attributes(root.attributes)}"]
+
+    def _walk(parent: Span, depth: int) -> None:
+        for item in sorted(children.get(parent.span_id, []), key=lambda s: s.start_ns):
+            if len(lines) > _MAX_DUMP_LINES:
+                return
+            duration = "进行中" if item.duration is None else f"{item.duration:.2f}s"
+            line = f"{'  ' * depth}- {item.name} {duration}{_format_attributes(item.attributes)}"
+            if item.error:
+                line += f" ❌ {item.error}"
+            lines.append(line)
+            _walk(item, depth + 1)
+
+    _walk(root, 1)
+    if len(lines) > _MAX_DUMP_LINES:
+        lines = lines[:_MAX_DUMP_LINES] + ["  ..."]
+    return "\n".join(lines)
+
+
+def format_slow_traces(limit: int = 5) -> str:
+    """最近 limit 条慢请求，新的在前"""
+    traces = list(_slow_traces)[-limit:][::-1] if limit > 0 else []
+    if not traces:
+        return f"暂无慢请求（阈值 {plugin_config.trace_slow_threshold:g}s）"
+    header = f"🐢 最近 {len(traces)} 条慢请求（≥ {plugin_config.trace_slow_threshold:g}s）"
+    return "\n\n".join([header] + [format_trace(trace) for trace in traces])
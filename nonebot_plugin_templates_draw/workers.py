@@ -0,0 +1,61 @@
+import os, asyncio, multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+from nonebot import logger, get_plugin_config
+
+from .config import Config
+
+plugin_config = get_plugin_config(Config).templates_draw
+
+T = TypeVar("T")
+
+# 图片解码/编码、PDF 构建等 CPU 密集任务使用的执行器，首次使用时创建
+_executor: Optional[Executor] = None
+
+
+def _worker_type() -> str:
+    """
+    进程池只支持 fork 启动方式：spawn / forkserver 会在子进程里重新导入插件包，
+    而插件的 __init__ 依赖已初始化的 NoneBot。不支持 fork 的平台（Windows）回退为线程池。
+    """
+    if plugin_config.image_worker_type != "process":
+        return "thread"
+    if "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("[templates-draw] 当前平台不支持 fork，image_worker_type=process 回退为 thread")
+        return "thread"
+    return "process"
+
+
+def get_executor() -> Executor:
+    """获取图片/PDF 任务执行器（线程池或 fork 方式启动的进程池）"""
+    global _executor
+    if _executor is None:
+        workers = plugin_config.image_worker_count or min(4, os.cpu_count() or 1)
+        worker_type = _worker_type()
+        if worker_type == "process":
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+        else:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="templates-draw")
+        logger.debug(f"[templates-draw] 创建图片任务执行器: {worker_type} x {workers}")
+    return _executor
+
+
+async def run_in_worker(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在执行器中运行 func，不阻塞事件循环。
+    使用进程池时 func 与参数必须可被 pickle（模块级函数、PIL Image、bytes 等）。
+    """
+    loop = asyncio.get_running_loop()
+    if kwargs:
+        func = partial(func, **kwargs)
+    return await loop.run_in_executor(get_executor(), func, *args)
+
+
+def shutdown_executor() -> None:
+    """关闭执行器"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,94 @@
+import os
+import re
+import sys
+import time
+import base64
+
+import nonebot
+
+# 比较 extract_images_and_text 新旧实现在大响应（5~20 MB）下的耗时
+# 用法：python test/bench_extract.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+nonebot.init()
+nonebot.load_plugin("nonebot_plugin_templates_draw")
+from nonebot_plugin_templates_draw.api_handler import (  # noqa: E402
+    _URL_PATTERN,
+    _IMAGE_EXTS,
+    _MARKDOWN_CLEANUP,
+    _WHITESPACE_PATTERN,
+    _LINE_SPACES_PATTERN,
+    extract_images_and_text,
+)
+
+# --- 配置 ---
+sizes_mb = [5, 10, 20]
+rounds = 5
+
+_LEGACY_BASE64_PATTERN = re.compile(r'data:image/[^;,\s]+;base64,([A-Za-z0-9+/=\s]+)')
+
+
+def legacy_extract(content: str):
+    """旧实现：对整段文本依次做正则替换"""
+    images = []
+
+    def _handle_base64_match(match):
+        b64str = re.sub(r'\s+', '', match.group(1))
+        images.append((base64.b64decode(b64str), None))
+        return ""
+
+    def _handle_url_match(match):
+        url = match.group(0)
+        if any(url.lower().endswith(ext) for ext in _IMAGE_EXTS):
+            images.append((None, url))
+            return ""
+        return url
+
+    text_content = _LEGACY_BASE64_PATTERN.sub(_handle_base64_match, content)
+    text_content = _URL_PATTERN.sub(_handle_url_match, text_content)
+    for pattern in _MARKDOWN_CLEANUP:
+        text_content = pattern.sub('', text_content)
+    text_content = _WHITESPACE_PATTERN.sub('\n', text_content)
+    text_content = _LINE_SPACES_PATTERN.sub('', text_content)
+    return images, text_content.strip() or None
+
+
+def make_response(size_mb: int) -> str:
+    """构造一个包含两张 base64 图片（带换行）和少量文本的 OpenAI 文本响应"""
+    raw = os.urandom(size_mb * 1024 * 1024 * 3 // 8)
+    b64 = base64.b64encode(raw).decode()
+    wrapped = "\n".join(b64[i:i + 76] for i in range(0, len(b64), 76))
+    return (
+        "这是生成的图片：\n"
+        f"![image](data:image/png;base64,{wrapped})\n"
+        "第二张：\n"
+        f"![image](data:image/png;base64,{wrapped})\n"
+        "原图链接 https://example.com/result.png"
+    )
+
+
+def bench(func, content: str) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'大小':>8} {'旧实现':>10} {'新实现':>10} {'加速比':>8}")
+    for size_mb in sizes_mb:
+        content = make_response(size_mb)
+        old_images, old_text = legacy_extract(content)
+        new_images, new_text = extract_images_and_text(content)
+        assert old_images == new_images and old_text == new_text, "新旧实现结果不一致"
+
+        old = bench(legacy_extract, content)
+        new = bench(extract_images_and_text, content)
+        size = len(content) / 1024 / 1024
+        print(f"{size:>6.1f}MB {old * 1000:>8.1f}ms {new * 1000:>8.1f}ms {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
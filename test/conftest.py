@@ -0,0 +1,130 @@
+import sys
+import json
+import base64
+import asyncio
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+import pytest
+import nonebot
+from PIL import Image
+from nonebot.adapters.onebot.v11 import Adapter as OneBotV11Adapter
+
+# 基准测试使用本地模拟上游，不访问真实 API
+# 用法：pytest test --benchmark-autosave，之后用 --benchmark-compare 对比历史结果
+
+MOCK_KEYS = [f"mock-key-{i}" for i in range(8)]
+MOCK_RESULT_URL = "https://mock.local/results/{}.png"
+
+_store_dir = Path(tempfile.mkdtemp(prefix="templates-draw-bench-"))
+nonebot.init(
+    log_level="WARNING",
+    localstore_cache_dir=str(_store_dir / "cache"),
+    localstore_config_dir=str(_store_dir / "config"),
+    localstore_data_dir=str(_store_dir / "data"),
+    templates_draw={"gemini_api_keys": MOCK_KEYS, "hedge_enabled": False},
+)
+nonebot.get_driver().register_adapter(OneBotV11Adapter)
+nonebot.load_plugin("nonebot_plugin_templates_draw")
+
+from nonebot_plugin_templates_draw import http_client  # noqa: E402
+
+
+def make_image(size=(1024, 1024), mode="RGB") -> Image.Image:
+    """带噪点的测试图，避免纯色图被压缩得过小"""
+    img = Image.effect_noise(size, 40).convert(mode)
+    return img
+
+
+def _png_bytes(size=(512, 512)) -> bytes:
+    buf = BytesIO()
+    make_image(size).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+RESULT_PNG = _png_bytes()
+RESULT_B64 = base64.b64encode(RESULT_PNG).decode()
+
+
+def gemini_response() -> dict:
+    return {"candidates": [{"content": {"parts": [
+        {"text": "这是生成的图片"},
+        {"inlineData": {"mimeType": "image/png", "data": RESULT_B64}},
+    ]}}]}
+
+
+def openai_response() -> dict:
+    wrapped = "\n".join(RESULT_B64[i:i + 76] for i in range(0, len(RESULT_B64), 76))
+    content = f"这是生成的图片：\n![image](data:image/png;base64,{wrapped})"
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+def doubao_response() -> dict:
+    return {"data": [{"url": MOCK_RESULT_URL.format(0)}]}
+
+
+class MockUpstream:
+    """模拟 Gemini Native / OpenAI 兼容 / 豆包 三种上游，latency 为每次请求的模拟耗时"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = request.url.path
+        if request.method == "GET" and path.startswith("/results/"):
+            return httpx.Response(200, content=RESULT_PNG, headers={"Content-Type": "image/png"})
+        if path.endswith(":generateContent"):
+            return httpx.Response(200, json=gemini_response())
+        if path.endswith("/chat/completions"):
+            return httpx.Response(200, json=openai_response())
+        if path.endswith("/images/generations"):
+            return httpx.Response(200, json=doubao_response())
+        return httpx.Response(404, content=json.dumps({"error": f"unknown path {path}"}))
+
+
+API_SETTINGS = {
+    "gemini": {"api_type": "gemini", "gemini_api_url": "https://gemini.mock/v1beta"},
+    "openai": {"api_type": "openai", "gemini_api_url": "https://openai.mock/v1/chat/completions"},
+    "doubao": {"api_type": "doubao", "doubao_api_url": "https://doubao.mock/api/v3"},
+}
+
+
+def set_plugin_config(**values) -> None:
+    """每个模块各自持有一份 plugin_config，需要逐个修改"""
+    for name, module in list(sys.modules.items()):
+        if name.startswith("nonebot_plugin_templates_draw") and hasattr(module, "plugin_config"):
+            for key, value in values.items():
+                setattr(module.plugin_config, key, value)
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(http_client.close_clients())
+    loop.close()
+
+
+@pytest.fixture
+def upstream():
+    """安装模拟上游，返回 MockUpstream 以便调整延迟、统计请求数"""
+    mock = MockUpstream()
+    http_client._clients.clear()
+    http_client.init_clients(transport=httpx.MockTransport(mock))
+    yield mock
+    http_client._clients.clear()
+
+
+@pytest.fixture(params=list(API_SETTINGS))
+def api_type(request, upstream):
+    """依次切换到三种上游"""
+    defaults = {"api_type": "gemini", "gemini_api_url": "https://gemini.mock/v1beta"}
+    set_plugin_config(**API_SETTINGS[request.param])
+    yield request.param
+    set_plugin_config(**defaults)
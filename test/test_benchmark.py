@@ -0,0 +1,123 @@
+import os
+import base64
+import asyncio
+
+import pytest
+
+from nonebot_plugin_templates_draw.api_handler import (
+    build_payload,
+    encode_image_to_base64,
+    extract_images_and_text,
+    generate_template_images,
+    parse_api_response,
+)
+from nonebot_plugin_templates_draw.pdf_builder import build_pdf_from_prompt_and_images
+
+from conftest import (
+    make_image,
+    gemini_response,
+    openai_response,
+    doubao_response,
+    set_plugin_config,
+)
+
+PROMPT = (
+    "Using the nano-banana model, a commercial 1/7 scale figurine of the character in the picture was created, "
+    "depicting a realistic style and a realistic environment. 手办放置在电脑桌上，使用圆形透明亚克力底座。"
+)
+
+# 编码结果按图片对象缓存，每轮都换新图片才能测到真实的编码耗时
+ROUNDS = 5
+
+
+def _fresh_images(count=2, size=(1024, 1024)):
+    return [make_image(size) for _ in range(count)]
+
+
+@pytest.mark.benchmark(group="build_payload")
+def test_build_payload(benchmark, loop, api_type):
+    def setup():
+        return (api_type, _fresh_images(), PROMPT, False), {}
+
+    payload = benchmark.pedantic(
+        lambda *args: loop.run_until_complete(build_payload(*args)), setup=setup, rounds=ROUNDS
+    )
+    assert payload
+
+
+@pytest.mark.benchmark(group="build_payload")
+def test_build_payload_pdf(benchmark, loop, upstream):
+    set_plugin_config(gemini_pdf_jailbreak=True)
+    try:
+        def setup():
+            return ("gemini", _fresh_images(), PROMPT, True), {}
+
+        payload = benchmark.pedantic(
+            lambda *args: loop.run_until_complete(build_payload(*args)), setup=setup, rounds=ROUNDS
+        )
+    finally:
+        set_plugin_config(gemini_pdf_jailbreak=False)
+    assert payload["contents"]
+
+
+@pytest.mark.benchmark(group="encode_image_to_base64")
+@pytest.mark.parametrize("size", [(512, 512), (2048, 2048), (4096, 3072)], ids=lambda s: f"{s[0]}x{s[1]}")
+def test_encode_image_to_base64(benchmark, size):
+    mime, b64data = benchmark.pedantic(
+        encode_image_to_base64, setup=lambda: ((make_image(size),), {}), rounds=ROUNDS
+    )
+    assert mime.startswith("image/") and b64data
+
+
+@pytest.mark.benchmark(group="extract_images_and_text")
+@pytest.mark.parametrize("size_mb", [1, 5, 20])
+def test_extract_images_and_text(benchmark, size_mb):
+    b64 = base64.b64encode(os.urandom(size_mb * 1024 * 1024 * 3 // 4)).decode()
+    wrapped = "\n".join(b64[i:i + 76] for i in range(0, len(b64), 76))
+    content = f"这是生成的图片：\n![image](data:image/png;base64,{wrapped})\n原图 https://example.com/a.png"
+
+    images, text = benchmark(extract_images_and_text, content)
+    assert len(images) == 2 and text
+
+
+@pytest.mark.benchmark(group="parse_api_response")
+@pytest.mark.parametrize(
+    "api_type, response",
+    [("gemini", gemini_response), ("openai", openai_response), ("doubao", doubao_response)],
+    ids=["gemini", "openai", "doubao"],
+)
+def test_parse_api_response(benchmark, api_type, response):
+    data = response()
+    content, parts, error = benchmark(parse_api_response, data, api_type)
+    assert error is None and (content or parts)
+
+
+@pytest.mark.benchmark(group="build_pdf")
+@pytest.mark.parametrize("count", [1, 4])
+def test_build_pdf_from_prompt_and_images(benchmark, count):
+    pdf = benchmark.pedantic(
+        build_pdf_from_prompt_and_images,
+        setup=lambda: ((PROMPT, _fresh_images(count)), {}),
+        rounds=ROUNDS,
+    )
+    assert pdf.startswith(b"%PDF")
+
+
+@pytest.mark.benchmark(group="generate_template_images")
+@pytest.mark.parametrize("concurrency", [1, 4, 16])
+def test_generate_template_images(benchmark, loop, api_type, upstream, concurrency):
+    """端到端吞吐：concurrency 个请求同时生成，模拟上游每次耗时 50ms"""
+    upstream.latency = 0.05
+
+    async def run_batch(batches):
+        return await asyncio.gather(*(generate_template_images(images, PROMPT) for images in batches))
+
+    def setup():
+        return ([_fresh_images(1, (512, 512)) for _ in range(concurrency)],), {}
+
+    results = benchmark.pedantic(
+        lambda batches: loop.run_until_complete(run_batch(batches)), setup=setup, rounds=3
+    )
+    benchmark.extra_info["requests_per_round"] = concurrency
+    assert len(results) == concurrency
+    assert all(result and result[0][0] for result in results)
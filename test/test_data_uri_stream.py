@@ -0,0 +1,78 @@
+import base64
+import random
+
+import pytest
+
+from nonebot_plugin_templates_draw.api_handler import _DataUriStream, extract_images_and_text
+
+IMAGE_1 = bytes(range(256)) * 40
+IMAGE_2 = b"\x89PNG\r\n\x1a\n" + bytes(997)
+
+WRAPPED = "\n".join(
+    base64.b64encode(IMAGE_1).decode()[i:i + 76] for i in range(0, len(base64.b64encode(IMAGE_1)), 76)
+)
+CONTENT = (
+    "这是生成的图片 https://example.com/a.png\n"
+    f"![image](data:image/png;base64,{WRAPPED})\n"
+    "中间 data:image/ 不是图片\n"
+    f"data:image/jpeg;base64,{base64.b64encode(IMAGE_2).decode()} 结尾"
+)
+
+
+def _feed(content: str, sizes):
+    stream = _DataUriStream()
+    items = []
+    pos = 0
+    for size in sizes:
+        items += stream.feed(content[pos:pos + size])
+        pos += size
+    items += stream.feed(content[pos:])
+    items += stream.close()
+    return items
+
+
+def _split(items):
+    return [x for x in items if isinstance(x, bytes)], [x for x in items if isinstance(x, str)]
+
+
+def test_whole_content_matches_non_streaming():
+    images, texts = _split(_feed(CONTENT, []))
+    expected_images, expected_text = extract_images_and_text(CONTENT, None, "openai")
+
+    assert images == [img for img, _ in expected_images if img is not None] == [IMAGE_1, IMAGE_2]
+    assert texts == [
+        "这是生成的图片 https://example.com/a.png\n",
+        "\n中间 data:image/ 不是图片\n",
+        "结尾",  # base64 之后的空白与非流式扫描一样被并入 base64 段
+    ]
+    joined = "\n".join(filter(None, (extract_images_and_text(t, None, "openai")[1] for t in texts)))
+    assert joined == expected_text
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_chunks(seed):
+    rng = random.Random(seed)
+    sizes = [rng.randint(1, 40) for _ in range(len(CONTENT))]
+    images, texts = _split(_feed(CONTENT, sizes))
+
+    assert images == [IMAGE_1, IMAGE_2]
+    assert "".join(texts) == "".join(_split(_feed(CONTENT, []))[1])
+
+
+def test_single_characters():
+    images, texts = _split(_feed(CONTENT, [1] * len(CONTENT)))
+    assert images == [IMAGE_1, IMAGE_2]
+    assert "![" not in "".join(texts)
+
+
+def test_text_before_image_is_released_early():
+    stream = _DataUriStream()
+    assert stream.feed("前言 ") == []
+    assert stream.feed("data:image/png;base64,AAAA") == ["前言 "]
+    assert stream.feed("AAAA") == []
+    assert stream.feed(" 后记") == [bytes(6)]
+    assert stream.close() == ["后记"]
+
+
+def test_truncated_prefix_is_text():
+    assert _feed("只有 data:ima", [4, 3]) == ["只有 data:ima"]
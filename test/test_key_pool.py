@@ -0,0 +1,136 @@
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from nonebot_plugin_templates_draw import key_pool as key_pool_module
+from nonebot_plugin_templates_draw.key_pool import ApiKeyPool, mask_key, parse_retry_after
+
+
+class FakeClock:
+    """替换 time.monotonic，手动推进时间"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(key_pool_module.time, "monotonic", fake)
+    return fake
+
+
+def _status(pool: ApiKeyPool):
+    return {item["key"]: item["status"] for item in pool.stats()}
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after(" 12 ") == 12
+    assert parse_retry_after("-5") == 0
+    assert parse_retry_after("not a date") is None
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 <= parse_retry_after(format_datetime(later, usegmt=True)) <= 30
+
+
+def test_mask_key():
+    assert mask_key("short") == "sh***"
+    assert mask_key("sk-1234567890abcd") == "sk-1...abcd"
+
+
+def test_least_in_flight_then_least_recently_used(clock):
+    pool = ApiKeyPool(["a", "b", "c"])
+    first = [pool.acquire() for _ in range(3)]
+    assert sorted(first) == ["a", "b", "c"]
+
+    clock.now += 1
+    pool.release("b", status_code=200)
+    # b 进行中的请求最少
+    assert pool.acquire() == "b"
+
+    for key in ("a", "b", "c", "b"):
+        clock.now += 1
+        pool.release(key, status_code=200)
+    # 都空闲时选最久未使用的
+    assert pool.acquire() == "a"
+
+
+def test_exclude(clock):
+    pool = ApiKeyPool(["a", "b"])
+    assert pool.acquire(exclude=["a"]) == "b"
+    # 全部被排除时退回整个池
+    assert pool.acquire(exclude=["a", "b"]) in ("a", "b")
+
+
+def test_429_cooldown_uses_retry_after(clock):
+    pool = ApiKeyPool(["a", "b"], cooldown_seconds=60)
+    pool.release(pool.acquire(exclude=["b"]), status_code=429, retry_after=5)
+    assert _status(pool)["a***"] == "cooldown"
+    assert not pool.has_healthy(exclude=["b"])
+    assert pool.acquire() == "b"
+
+    clock.now += 5
+    assert _status(pool)["a***"] == "healthy"
+    assert pool.has_healthy(exclude=["b"])
+
+
+def test_429_without_retry_after_uses_default(clock):
+    pool = ApiKeyPool(["a"], cooldown_seconds=60)
+    pool.release(pool.acquire(), status_code=429)
+    clock.now += 59
+    assert _status(pool)["a***"] == "cooldown"
+    clock.now += 1
+    assert _status(pool)["a***"] == "healthy"
+
+
+def test_timeout_cooldown(clock):
+    pool = ApiKeyPool(["a"], timeout_cooldown_seconds=10)
+    pool.release(pool.acquire(), timeout=True)
+    assert _status(pool)["a***"] == "cooldown"
+    clock.now += 10
+    assert _status(pool)["a***"] == "healthy"
+
+
+def test_auth_quarantine_after_consecutive_failures(clock):
+    pool = ApiKeyPool(["a", "b"], quarantine_threshold=3, quarantine_seconds=1800)
+    for _ in range(2):
+        pool.release(pool.acquire(exclude=["b"]), status_code=401)
+    # 中间一次成功会清零连续计数
+    pool.release(pool.acquire(exclude=["b"]), status_code=200)
+    for _ in range(2):
+        pool.release(pool.acquire(exclude=["b"]), status_code=403)
+    assert _status(pool)["a***"] == "healthy"
+
+    pool.release(pool.acquire(exclude=["b"]), status_code=401)
+    assert _status(pool)["a***"] == "quarantined"
+    assert pool.acquire() == "b"
+
+    clock.now += 1800
+    assert _status(pool)["a***"] == "healthy"
+
+
+def test_fallback_prefers_cooldown_over_quarantine(clock):
+    pool = ApiKeyPool(["a", "b"], quarantine_threshold=1, quarantine_seconds=10)
+    pool.release(pool.acquire(exclude=["b"]), status_code=401)
+    pool.release(pool.acquire(exclude=["a"]), status_code=429, retry_after=100)
+    assert not pool.has_healthy()
+    # 都不可用时选冷却中的，即使隔离更早结束
+    assert pool.acquire() == "b"
+
+
+def test_cancelled_request_not_counted(clock):
+    pool = ApiKeyPool(["a"])
+    pool.release(pool.acquire())
+    stats = pool.stats()[0]
+    assert stats["in_flight"] == 0
+    assert stats["success"] == stats["failure"] == 0
+
+
+def test_empty_pool_rejected():
+    with pytest.raises(ValueError):
+        ApiKeyPool([])
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from nonebot_plugin_templates_draw import result_cache
+from nonebot_plugin_templates_draw.result_cache import shared_generation
+
+from conftest import set_plugin_config
+
+RESULTS = [(b"image-1", None, "说明"), (None, "https://mock.local/results/1.png", None)]
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_DIR", tmp_path / "results")
+    set_plugin_config(result_cache_ttl=600)
+    yield tmp_path / "results"
+    set_plugin_config(result_cache_ttl=0)
+
+
+class Generator:
+    """记录调用次数，release() 之后才返回结果"""
+
+    def __init__(self, results=RESULTS, error: Exception = None):
+        self.calls = 0
+        self.results = results
+        self.error = error
+        self.ready = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_join_inflight_request():
+    async def main():
+        generate = Generator()
+        joined = []
+
+        async def on_join():
+            joined.append(True)
+
+        owner = asyncio.create_task(shared_generation("k-join", generate))
+        await _settle()
+        waiters = [asyncio.create_task(shared_generation("k-join", generate, on_join=on_join)) for _ in range(3)]
+        await _settle()
+        generate.ready.set()
+
+        results = await asyncio.gather(owner, *waiters)
+        assert generate.calls == 1
+        assert joined == [True] * 3
+        assert all(r == RESULTS for r in results)
+        assert "k-join" not in result_cache._inflight
+
+    asyncio.run(main())
+
+
+def test_join_shares_failure():
+    async def main():
+        generate = Generator(error=RuntimeError("上游失败"))
+        owner = asyncio.create_task(shared_generation("k-fail", generate))
+        await _settle()
+        waiter = asyncio.create_task(shared_generation("k-fail", generate))
+        await _settle()
+        generate.ready.set()
+
+        for task in (owner, waiter):
+            with pytest.raises(RuntimeError, match="上游失败"):
+                await task
+        assert generate.calls == 1
+
+    asyncio.run(main())
+
+
+def test_waiter_takes_over_when_owner_cancelled():
+    async def main():
+        generate = Generator()
+        owner = asyncio.create_task(shared_generation("k-cancel", generate))
+        await _settle()
+        waiter = asyncio.create_task(shared_generation("k-cancel", generate))
+        await _settle()
+
+        owner.cancel()
+        await _settle()
+        generate.ready.set()
+        assert await waiter == RESULTS
+        assert owner.cancelled()
+        assert generate.calls == 2
+
+    asyncio.run(main())
+
+
+def test_successful_results_cached(cache_dir):
+    async def main():
+        generate = Generator()
+        generate.ready.set()
+        assert await shared_generation("k-ok", generate) == RESULTS
+        assert await shared_generation("k-ok", generate) == RESULTS
+        return generate.calls
+
+    assert asyncio.run(main()) == 1
+    assert (cache_dir / "k-ok.json").exists()
+
+
+def test_partial_results_not_cached(cache_dir):
+    partial = [(b"image-1", None, None), (None, None, "第 2 张图片生成失败")]
+
+    async def main():
+        generate = Generator(results=partial)
+        generate.ready.set()
+        assert await shared_generation("k-partial", generate) == partial
+        assert await shared_generation("k-partial", generate) == partial
+        return generate.calls
+
+    assert asyncio.run(main()) == 2
+    assert not (cache_dir / "k-partial.json").exists()
+
+
+def test_expired_cache_ignored(cache_dir, monkeypatch):
+    generate = Generator()
+
+    async def main():
+        generate.ready.set()
+        return await shared_generation("k-ttl", generate)
+
+    asyncio.run(main())
+    now = result_cache.time.time()
+    monkeypatch.setattr(result_cache.time, "time", lambda: now + 601)
+    asyncio.run(main())
+    assert generate.calls == 2
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from nonebot_plugin_templates_draw.scheduler import GenerationScheduler, QueueFullError
+
+
+class Job:
+    """占住一个生成位置，直到 release() 被调用"""
+
+    def __init__(self, scheduler: GenerationScheduler, group_id: int, user_id: int):
+        self.started = asyncio.Event()
+        self.done = asyncio.Event()
+        self.queued_at = None
+
+        async def _on_queued(position: int):
+            self.queued_at = position
+
+        async def _run():
+            async with scheduler.slot(group_id, user_id, on_queued=_on_queued):
+                self.started.set()
+                await self.done.wait()
+
+        self.task = asyncio.create_task(_run())
+
+    def release(self):
+        self.done.set()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_other_group_not_blocked_by_group_limit():
+    async def main():
+        scheduler = GenerationScheduler(global_limit=6, group_limit=1, max_queue=20)
+        first = Job(scheduler, group_id=1, user_id=1)
+        await _settle()
+        second = Job(scheduler, group_id=1, user_id=2)
+        await _settle()
+        assert first.started.is_set() and not second.started.is_set()
+        assert second.queued_at == 1
+
+        other = Job(scheduler, group_id=2, user_id=3)
+        await _settle()
+        assert other.started.is_set()
+        assert other.queued_at is None
+        assert scheduler.running == 2 and scheduler.queue_depth == 1
+
+        first.release()
+        await _settle()
+        assert second.started.is_set()
+        for job in (second, other):
+            job.release()
+        await asyncio.gather(first.task, second.task, other.task)
+        assert scheduler.running == 0 and scheduler.queue_depth == 0
+
+    asyncio.run(main())
+
+
+def test_queue_full_rejects():
+    async def main():
+        scheduler = GenerationScheduler(global_limit=1, group_limit=0, max_queue=1)
+        running = Job(scheduler, group_id=1, user_id=1)
+        queued = Job(scheduler, group_id=2, user_id=2)
+        await _settle()
+        assert queued.queued_at == 1
+
+        with pytest.raises(QueueFullError):
+            async with scheduler.slot(3, 3):
+                pass
+
+        running.release()
+        await _settle()
+        queued.release()
+        await asyncio.gather(running.task, queued.task)
+        assert scheduler.running == 0
+
+    asyncio.run(main())
+
+
+def test_cancel_while_queued():
+    async def main():
+        scheduler = GenerationScheduler(global_limit=1, group_limit=0, max_queue=5)
+        running = Job(scheduler, group_id=1, user_id=1)
+        queued = Job(scheduler, group_id=1, user_id=2)
+        await _settle()
+        assert scheduler.queue_depth == 1
+
+        queued.task.cancel()
+        await _settle()
+        assert queued.task.cancelled()
+        assert scheduler.queue_depth == 0
+
+        running.release()
+        await running.task
+        assert scheduler.running == 0
+
+        # 被取消的任务不应占用位置
+        after = Job(scheduler, group_id=1, user_id=3)
+        await _settle()
+        assert after.started.is_set() and after.queued_at is None
+        after.release()
+        await after.task
+
+    asyncio.run(main())
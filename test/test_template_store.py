@@ -0,0 +1,90 @@
+import json
+import asyncio
+from pathlib import Path
+
+from nonebot_plugin_templates_draw.template_store import TemplateRegistry
+
+
+def _registry(tmp_path: Path) -> TemplateRegistry:
+    default_file = tmp_path / "default_prompt.json"
+    if not default_file.exists():
+        default_file.write_text(json.dumps({"默认": "默认提示词"}, ensure_ascii=False), "utf-8")
+    # 写回延迟足够长，测试里的修改只会停留在日志中，模拟写回前崩溃
+    return TemplateRegistry(default_file, tmp_path / "prompt.json", write_delay=3600)
+
+
+def test_journal_replayed_after_crash(tmp_path):
+    async def crash():
+        registry = _registry(tmp_path)
+        await registry.set("新模板", "新提示词 ")
+        await registry.set("默认", "覆盖默认")
+        await registry.set("临时", "很快删除")
+        await registry.remove("临时")
+        # 不调用 close/flush，直接丢弃，相当于进程被杀
+        registry._flush_task.cancel()
+
+    asyncio.run(crash())
+    assert not (tmp_path / "prompt.json").exists()
+    assert len((tmp_path / "prompt.json.journal").read_text("utf-8").splitlines()) == 4
+
+    async def restart():
+        registry = _registry(tmp_path)
+        await registry.recover()
+        return registry.templates()
+
+    templates = asyncio.run(restart())
+    assert templates == {"默认": "覆盖默认", "新模板": "新提示词"}
+    assert json.loads((tmp_path / "prompt.json").read_text("utf-8")) == {"新模板": "新提示词", "默认": "覆盖默认"}
+    assert (tmp_path / "prompt.json.journal").read_text("utf-8") == ""
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_torn_journal_line_ignored(tmp_path):
+    (tmp_path / "prompt.json").write_text(json.dumps({"已有": "a"}, ensure_ascii=False), "utf-8")
+    (tmp_path / "prompt.json.journal").write_text(
+        json.dumps({"op": "set", "id": "完整", "prompt": "b"}, ensure_ascii=False) + "\n"
+        + '{"op": "set", "id": "写到一半', "utf-8"
+    )
+
+    async def restart():
+        registry = _registry(tmp_path)
+        await registry.recover()
+        return registry.templates()
+
+    assert asyncio.run(restart()) == {"默认": "默认提示词", "已有": "a", "完整": "b"}
+    assert json.loads((tmp_path / "prompt.json").read_text("utf-8")) == {"已有": "a", "完整": "b"}
+
+
+def test_corrupt_user_file_backed_up(tmp_path):
+    corrupt = '{"旧模板": "被截断的'
+    (tmp_path / "prompt.json").write_text(corrupt, "utf-8")
+    (tmp_path / "prompt.json.journal").write_text(
+        json.dumps({"op": "set", "id": "日志中的", "prompt": "c"}, ensure_ascii=False) + "\n", "utf-8"
+    )
+
+    async def restart():
+        registry = _registry(tmp_path)
+        await registry.recover()
+        return registry.templates()
+
+    assert asyncio.run(restart()) == {"默认": "默认提示词", "日志中的": "c"}
+
+    backups = list(tmp_path.glob("prompt.json.corrupt-*"))
+    assert len(backups) == 1
+    assert backups[0].read_text("utf-8") == corrupt
+    assert json.loads((tmp_path / "prompt.json").read_text("utf-8")) == {"日志中的": "c"}
+
+
+def test_flush_rewrites_atomically(tmp_path):
+    async def main():
+        registry = _registry(tmp_path)
+        await registry.set("a", "1")
+        await registry.set("b", "2")
+        await registry.close()
+        return registry
+
+    registry = asyncio.run(main())
+    assert json.loads((tmp_path / "prompt.json").read_text("utf-8")) == {"a": "1", "b": "2"}
+    assert (tmp_path / "prompt.json.journal").read_text("utf-8") == ""
+    assert not list(tmp_path.glob(".*.tmp"))
+    assert registry.get("a") == "1"